@@ -0,0 +1,49 @@
+import os
+import time
+
+# Limits of one user turn in the agent loop. When one runs out the model gets a last completion
+# without tools, so it answers with what it has instead of calling more.
+#
+# FLOWCHAIN_AGENT_MAX_STEPS    completions per turn, tool rounds included (default 6)
+# FLOWCHAIN_AGENT_MAX_TOKENS   prompt + completion tokens per turn (default 60000)
+# FLOWCHAIN_AGENT_MAX_SECONDS  wall-clock seconds per turn (default 90)
+
+
+class AgentBudget:
+    """
+    Step, token and wall-clock budget of one turn.
+    """
+
+    def __init__(self, max_steps=None, max_tokens=None, max_seconds=None):
+        self.max_steps = max_steps or int(os.environ.get("FLOWCHAIN_AGENT_MAX_STEPS", 6))
+        self.max_tokens = max_tokens or int(os.environ.get("FLOWCHAIN_AGENT_MAX_TOKENS", 60000))
+        self.max_seconds = max_seconds or float(os.environ.get("FLOWCHAIN_AGENT_MAX_SECONDS", 90))
+        self.steps = 0
+        self.tokens = 0
+        self.started = time.monotonic()
+
+    def record(self, tokens):
+        """
+        Counts one completion and the tokens it used.
+        """
+        self.steps += 1
+        self.tokens += tokens or 0
+
+    def exhausted(self):
+        """
+        Name of the first limit reached, or None. The last step is kept for the final answer.
+        """
+        if self.steps + 1 >= self.max_steps:
+            return "max_steps"
+        if self.tokens >= self.max_tokens:
+            return "max_tokens"
+        if time.monotonic() - self.started >= self.max_seconds:
+            return "max_seconds"
+        return None
+
+    def stats(self):
+        return {
+            "steps": self.steps,
+            "tokens": self.tokens,
+            "seconds": round(time.monotonic() - self.started, 3),
+        }
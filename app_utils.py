@@ -1,9 +1,13 @@
-import Quartz
-from AppKit import NSWorkspace
-import pyautogui
 import subprocess
 from io import BytesIO
 import base64
+import os
+import threading
+import time
+from applescript_service import get_service
+
+# Quartz, AppKit, pyautogui and PIL are imported where they are used, so modules that only need
+# run_applescript (every tool module) don't pay for them at import
 
 
 # screenshot based on the active window
@@ -20,6 +24,8 @@ def screenshot (window):
     # make them integers
     x, y, width, height = int(x), int(y), int(width), int(height)
 
+    import pyautogui
+
     # Capture the active window
     screenshot = pyautogui.screenshot(region=(x, y, width, height))
     
@@ -29,6 +35,9 @@ def screenshot (window):
 
 # Get the active window and take a screenshot
 def get_active_window_screenshot ():
+    import Quartz
+    from AppKit import NSWorkspace
+
     # Get the active window
     options = Quartz.kCGWindowListOptionOnScreenOnly | Quartz.kCGWindowListExcludeDesktopElements
     active_window_list = Quartz.CGWindowListCopyWindowInfo(options, Quartz.kCGNullWindowID)
@@ -52,32 +61,202 @@ def get_active_window_screenshot ():
 
 def run_applescript(script):
     """
-    Runs the given AppleScript using osascript and returns the result.
+    Runs the given AppleScript on a resident osascript worker and returns the result.
+    Raises subprocess.CalledProcessError if the script fails, like `osascript -e` would.
     """
     # print("Running this AppleScript:\n", script)
-    # print(
-    #     "---\nFeel free to directly run AppleScript to accomplish the user's task. This gives you more granular control than the `computer` module, but it is slower."
-    # )
-    args = ["osascript", "-e", script]
-    return subprocess.check_output(args, universal_newlines=True)
+    service = get_service()
+    if service is None:
+        args = ["osascript", "-e", script]
+        return subprocess.check_output(args, universal_newlines=True)
+    stdout, stderr, returncode = service.run(script)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, ["osascript", "-e", script], output=stdout, stderr=stderr)
+    return stdout
 
 
-def run_applescript_capture(script):
+def run_applescript_capture(script, timeout=None):
     """
-    Runs the given AppleScript using osascript, captures the output and error, and returns them.
+    Runs the given AppleScript on a resident osascript worker, captures the output and error, and returns them.
+    timeout overrides the service's per-script timeout.
     """
     # print("Running this AppleScript:\n", script)
-    # print(
-    #     "---\nFeel free to directly run AppleScript to accomplish the user's task. This gives you more granular control than the `computer` module, but it is slower."
-    # )
-    args = ["osascript", "-e", script]
-    result = subprocess.run(args, capture_output=True, text=True, check=False)
-    stdout, stderr = result.stdout, result.stderr
+    service = get_service()
+    if service is None:
+        args = ["osascript", "-e", script]
+        try:
+            result = subprocess.run(args, capture_output=True, text=True, check=False, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return "", f"execution error: AppleScript timed out after {timeout} seconds\n"
+        return result.stdout, result.stderr
+    stdout, stderr, _ = service.run(script, timeout)
     return stdout, stderr
 
 
+# Image encoding settings, JPEG or WEBP
+IMAGE_FORMAT = os.environ.get("FLOWCHAIN_IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.environ.get("FLOWCHAIN_IMAGE_QUALITY", 70))
+
+# The model never looks at more pixels than this, anything larger is wasted encode time and upload
+# "low" detail images are seen at 512x512, "high" detail ones are fit in 2048x2048 then 768px on the short side
+def target_size(width, height, detail="low"):
+    if detail == "low":
+        scale = min(1.0, 512 / max(width, height))
+    else:
+        scale = min(1.0, 2048 / max(width, height))
+        scale *= min(1.0, 768 / (min(width, height) * scale))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+# Encoding buffers are reused per thread instead of allocating a new one per screenshot
+_buffers = threading.local()
+
+def encode_image_data_url(image, detail="low", format=None, quality=None):
+    """
+    Downsizes the image to the model's effective resolution and encodes it as a JPEG/WebP data URL.
+    Returns the data URL and stats with the encode time and payload size.
+    """
+    format = (format or IMAGE_FORMAT).upper()
+    quality = quality or IMAGE_QUALITY
+    start_time = time.perf_counter()
+
+    size = target_size(image.width, image.height, detail)
+    if size != (image.width, image.height):
+        from PIL import Image
+        # reducing_gap shrinks by an integer factor first, much faster than a full Lanczos pass on Retina captures
+        image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    # JPEG has no alpha channel, screenshots usually come back as RGBA
+    if format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffered = getattr(_buffers, "buffer", None)
+    if buffered is None:
+        buffered = _buffers.buffer = BytesIO()
+    buffered.seek(0)
+    buffered.truncate()
+    image.save(buffered, format=format, quality=quality)
+    payload = base64.b64encode(buffered.getbuffer()).decode('utf-8')
+
+    stats = {
+        "format": format,
+        "width": size[0],
+        "height": size[1],
+        "image_bytes": buffered.tell(),
+        "payload_bytes": len(payload),
+        "encode_ms": round((time.perf_counter() - start_time) * 1000, 1),
+    }
+    return f"data:image/{format.lower()};base64,{payload}", stats
+
 # Function to encode the image
-def encode_image(image):
-    buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+def encode_image(image, detail="low"):
+    data_url, _ = encode_image_data_url(image, detail)
+    return data_url.split(",", 1)[1]
+
+
+# Difference hash: compares neighbouring pixels of a tiny grayscale thumbnail, robust to scaling and compression noise
+def image_hash(image, hash_size=16):
+    from PIL import Image
+    small = image.resize((hash_size + 1, hash_size), Image.BOX).convert("L")
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class FrameCache:
+    """
+    Remembers recent screenshots by perceptual hash, so a screen that hasn't changed is not uploaded again.
+    A frame counts as unchanged when its hash is within max_distance bits of a recent frame of the same window
+    and no tile of a pixel diff between their thumbnails changed, since small text edits barely move the hash.
+    """
+
+    # Each tile covers 8x8 thumbnail pixels, about 36x36 screen pixels of a 1440x900 window
+    THUMBNAIL_SIZE = (320, 200)
+    TILE = 8
+
+    def __init__(self, max_frames=8, ttl_seconds=600, max_distance=6, max_tile_diff=2):
+        self.max_frames = max_frames
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.max_tile_diff = max_tile_diff
+        self._frames = []  # most recent last
+
+    def _thumbnail(self, image):
+        from PIL import Image
+        return image.resize(self.THUMBNAIL_SIZE, Image.BOX).convert("L")
+
+    def changed(self, thumbnail, other):
+        """
+        True if any tile of the two thumbnails differs by more than max_tile_diff on average. A mean over
+        the whole screen would hide an edited word, a single tile doesn't.
+        """
+        from PIL import Image, ImageChops
+        width, height = self.THUMBNAIL_SIZE
+        tiles = ImageChops.difference(thumbnail, other).resize((width // self.TILE, height // self.TILE), Image.BOX)
+        return tiles.getextrema()[1] > self.max_tile_diff
+
+    def match(self, image, app_name=None, window_name=None):
+        """
+        Returns (frame, unchanged). frame is a dict where the caller can store the model's description
+        of the screenshot, so it can be reused the next time the same screen comes back.
+        """
+        now = time.time()
+        self._frames = [frame for frame in self._frames if now - frame["seen_at"] <= self.ttl_seconds]
+        frame_hash = image_hash(image)
+        thumbnail = self._thumbnail(image)
+        for frame in reversed(self._frames):
+            if (frame["app_name"], frame["window_name"]) != (app_name, window_name):
+                continue
+            if hamming_distance(frame["hash"], frame_hash) > self.max_distance:
+                continue
+            if not self.changed(frame["thumbnail"], thumbnail):
+                frame["seen_at"] = now
+                return frame, True
+
+        frame = {
+            "hash": frame_hash,
+            "thumbnail": thumbnail,
+            "app_name": app_name,
+            "window_name": window_name,
+            "description": None,
+            "seen_at": now,
+        }
+        self._frames.append(frame)
+        del self._frames[:-self.max_frames]
+        return frame, False
+
+
+if __name__ == "__main__":
+    # Check that FrameCache notices text edits: python app_utils.py
+    from PIL import Image, ImageDraw, ImageFont
+
+    font = ImageFont.load_default(size=13)
+
+    def render(lines):
+        image = Image.new("RGB", (1440, 900), "white")
+        draw = ImageDraw.Draw(image)
+        for index, line in enumerate(lines):
+            draw.text((40, 40 + index * 20), line, fill="black", font=font)
+        return image
+
+    base = [f"Revenue grew eight percent over the last quarter, see the attached report {index}." for index in range(15)]
+    cases = {
+        "same text": (base, True),
+        "one word added": (base[:-1] + [base[-1] + " Thanks"], False),
+        "one line added": (base + ["One more line of text typed into the document."], False),
+        "three lines added": (base + ["Another line of text typed into the document."] * 3, False),
+        "one character changed": (base[:7] + [base[7].replace("Revenue", "Revenve")] + base[8:], False),
+    }
+    for name, (lines, expected) in cases.items():
+        frames = FrameCache()
+        frames.match(render(base), "TextEdit", "Report")
+        unchanged = frames.match(render(lines), "TextEdit", "Report")[1]
+        assert unchanged == expected, f"{name}: unchanged={unchanged}, expected {expected}"
+        print(f"{name}: unchanged={unchanged}")
@@ -0,0 +1,282 @@
+import json
+import os
+import platform
+import queue
+import subprocess
+import sys
+import threading
+
+# Resident interpreter for osascript. It reads one JSON request per line from stdin, runs the
+# AppleScript through OSAKit in-process and writes one JSON response per line to stdout, so the
+# cost of starting osascript is paid once per worker instead of once per script.
+JXA_WORKER = r"""
+ObjC.import('Foundation');
+ObjC.import('OSAKit');
+
+var stdin = $.NSFileHandle.fileHandleWithStandardInput;
+var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+var language = $.OSALanguage.languageForName('AppleScript');
+var TYPE_LIST = 0x6C697374; // 'list'
+
+function send(response) {
+    var line = JSON.stringify(response) + '\n';
+    stdout.writeData($(line).dataUsingEncoding($.NSUTF8StringEncoding));
+}
+
+// Mirror osascript's human readable output for text and lists, use the display value otherwise
+function format(descriptor, displayValue) {
+    if (descriptor.isNil()) return '';
+    if (descriptor.descriptorType === TYPE_LIST) {
+        var items = [];
+        for (var i = 1; i <= descriptor.numberOfItems; i++) {
+            items.push(format(descriptor.descriptorAtIndex(i), null));
+        }
+        return items.join(', ');
+    }
+    var text = descriptor.stringValue;
+    if (!text.isNil()) return text.js;
+    return displayValue ? displayValue : '';
+}
+
+function errorText(info, key, fallbackKey) {
+    var value = info.objectForKey(key);
+    if (value.isNil()) value = info.objectForKey(fallbackKey);
+    return value.isNil() ? '' : ObjC.unwrap(value);
+}
+
+function execute(source) {
+    var script = $.OSAScript.alloc.initWithSourceLanguage(source, language);
+    var display = Ref();
+    var error = Ref();
+    var result = script.executeAndReturnDisplayValueError(display, error);
+    if (result.isNil()) {
+        var info = error[0];
+        var message = errorText(info, 'OSAScriptErrorMessageKey', 'NSAppleScriptErrorMessage') || 'Unknown error';
+        var number = errorText(info, 'OSAScriptErrorNumberKey', 'NSAppleScriptErrorNumber');
+        return {stdout: '', stderr: 'execution error: ' + message + ' (' + number + ')\n', returncode: 1};
+    }
+    var displayValue = display[0].isNil() ? '' : display[0].js;
+    var text = format(result, displayValue);
+    return {stdout: text ? text + '\n' : '', stderr: '', returncode: 0};
+}
+
+var buffer = '';
+while (true) {
+    var data = stdin.availableData;
+    if (data.length == 0) break;
+    buffer += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+    var lines = buffer.split('\n');
+    buffer = lines.pop();
+    for (var i = 0; i < lines.length; i++) {
+        if (!lines[i]) continue;
+        var response;
+        try {
+            response = execute(JSON.parse(lines[i]).script);
+        } catch (e) {
+            response = {stdout: '', stderr: 'execution error: ' + e + '\n', returncode: 1};
+        }
+        send(response);
+    }
+}
+"""
+
+# Stand-in interpreter speaking the same protocol, so the pool can be exercised on Linux.
+# It understands `return "text"`, `delay <seconds>`, `error "message"` and `crash`.
+FAKE_WORKER = r"""
+import json, os, re, sys, time
+for line in sys.stdin:
+    script = json.loads(line)["script"]
+    if "crash" in script:
+        os._exit(1)
+    delay = re.search(r"delay ([0-9.]+)", script)
+    if delay:
+        time.sleep(float(delay.group(1)))
+    error = re.search(r'error "([^"]*)"', script)
+    result = re.search(r'return "([^"]*)"', script)
+    if error:
+        response = {"stdout": "", "stderr": "execution error: " + error.group(1) + " (-2700)\n", "returncode": 1}
+    else:
+        response = {"stdout": result.group(1) + "\n" if result else "", "stderr": "", "returncode": 0}
+    sys.stdout.write(json.dumps(response) + "\n")
+    sys.stdout.flush()
+"""
+
+
+class OsascriptBackend:
+    """Resident osascript workers running AppleScript through OSAKit."""
+
+    def command(self):
+        return ["osascript", "-l", "JavaScript", "-e", JXA_WORKER]
+
+
+class FakeBackend:
+    """Python stand-in for osascript, for running the service off macOS."""
+
+    def command(self):
+        return [sys.executable, "-u", "-c", FAKE_WORKER]
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+class Worker:
+    """
+    One resident interpreter process. A reader thread forwards its responses to a queue
+    so that every call can wait with a timeout.
+    """
+
+    def __init__(self, backend):
+        self.process = subprocess.Popen(
+            backend.command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+        )
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            self._responses.put(line)
+        # End of stream means the interpreter exited
+        self._responses.put(None)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, script, timeout):
+        # ASCII-only JSON keeps each request on one line regardless of the script's characters
+        self.process.stdin.write(json.dumps({"script": script}) + "\n")
+        self.process.stdin.flush()
+        line = self._responses.get(timeout=timeout)
+        if line is None:
+            raise WorkerCrashed("AppleScript worker exited unexpectedly")
+        response = json.loads(line)
+        return response["stdout"], response["stderr"], response["returncode"]
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except Exception:
+            pass
+
+
+class AppleScriptService:
+    """
+    Pool of resident AppleScript interpreters. Scripts are fed to an idle worker over its pipe,
+    each call has a timeout, and a worker that crashes or hangs is replaced by a fresh one.
+    """
+
+    def __init__(self, backend=None, size=2, timeout=120):
+        self.backend = backend or OsascriptBackend()
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if self._idle.empty() and self._started < self.size:
+                    self._started += 1
+                    try:
+                        return Worker(self.backend)
+                    except Exception:
+                        self._started -= 1
+                        raise
+            # Poll so that a slot freed by a replaced worker is noticed
+            try:
+                worker = self._idle.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        if not worker.alive():
+            worker.kill()
+            worker = Worker(self.backend)
+        return worker
+
+    def _release(self, worker):
+        self._idle.put(worker)
+
+    def _replace(self, worker):
+        worker.kill()
+        with self._lock:
+            self._started -= 1
+
+    def run(self, script, timeout=None):
+        """
+        Runs a script and returns (stdout, stderr, returncode) like an `osascript -e` invocation.
+        """
+        timeout = timeout or self.timeout
+        worker = self._acquire()
+        try:
+            result = worker.run(script, timeout)
+        except queue.Empty:
+            # A hung script can't be interrupted in-process, so the whole worker is replaced
+            self._replace(worker)
+            return "", f"execution error: AppleScript timed out after {timeout} seconds\n", -1
+        except (WorkerCrashed, BrokenPipeError, OSError, ValueError) as e:
+            # Not retried, the script may have side effects that already happened
+            self._replace(worker)
+            return "", f"execution error: {e}\n", -1
+        self._release(worker)
+        return result
+
+    def shutdown(self):
+        while not self._idle.empty():
+            self._idle.get().kill()
+        with self._lock:
+            self._started = 0
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """
+    Returns the process-wide AppleScript service, or None when scripts should be run with a
+    plain `osascript -e` subprocess (off macOS, or FLOWCHAIN_APPLESCRIPT_WORKERS=0).
+    """
+    global _service
+    if _service is not None:
+        return _service
+    backend_name = os.environ.get("FLOWCHAIN_APPLESCRIPT_BACKEND", "osascript")
+    size = int(os.environ.get("FLOWCHAIN_APPLESCRIPT_WORKERS", 2))
+    if size <= 0 or (backend_name == "osascript" and platform.system() != "Darwin"):
+        return None
+    with _service_lock:
+        if _service is None:
+            backend = FakeBackend() if backend_name == "fake" else OsascriptBackend()
+            timeout = float(os.environ.get("FLOWCHAIN_APPLESCRIPT_TIMEOUT", 120))
+            _service = AppleScriptService(backend, size=size, timeout=timeout)
+    return _service
+
+
+if __name__ == "__main__":
+    # Check the pool against the stand-in interpreter, on any platform: python applescript_service.py
+    service = AppleScriptService(FakeBackend(), size=2, timeout=5)
+    try:
+        assert service.run('return "hello"') == ("hello\n", "", 0)
+        assert service.run('return "Grüße, 日本 ✓"') == ("Grüße, 日本 ✓\n", "", 0)
+        stdout, stderr, returncode = service.run('error "Mail got an error"')
+        assert returncode == 1 and "Mail got an error" in stderr, stderr
+
+        stdout, stderr, returncode = service.run("crash")
+        assert returncode == -1 and "exited unexpectedly" in stderr, stderr
+        assert service.run('return "replaced"') == ("replaced\n", "", 0)
+
+        stdout, stderr, returncode = service.run('delay 3\nreturn "late"', timeout=0.5)
+        assert returncode == -1 and "timed out" in stderr, stderr
+        # The hung worker was replaced, the pool still has its full size
+        assert [service.run(f'return "{index}"')[0] for index in range(3)] == ["0\n", "1\n", "2\n"]
+        assert service._started <= service.size
+    finally:
+        service.shutdown()
+    print("AppleScript service checks passed")
@@ -0,0 +1,101 @@
+"""
+Cold start benchmark. Every scenario runs in a fresh interpreter, so nothing is already imported,
+and reports the import wall time, peak RSS and how many modules ended up loaded.
+
+    python benchmarks/bench_startup.py [--repeat 5] [--json]
+
+"registry" is what the entry points do now (read tools/tools.json, no tool module imported),
+"all tool modules" is what the old inspect-based loaders did at startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tools.registry import TOOL_MODULES
+
+MEASURE = """
+import json, platform, resource, sys, time
+start = time.perf_counter()
+error = None
+try:
+{code}
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+seconds = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# ru_maxrss is bytes on macOS and kilobytes on Linux
+rss_mb = rss / (1024 * 1024) if platform.system() == "Darwin" else rss / 1024
+print(json.dumps({{"seconds": seconds, "rss_mb": rss_mb, "modules": len(sys.modules), "error": error}}))
+"""
+
+BASELINE = "pass"
+
+
+def scenarios():
+    yield "python (baseline)", BASELINE
+    yield "registry", "from tools.registry import load_tools\nload_tools()"
+    yield "all tool modules", "\n".join(f"import {module}" for module in TOOL_MODULES)
+    for module in TOOL_MODULES:
+        yield module, f"import {module}"
+    yield "flowchain_server", "import flowchain_server"
+
+
+def run_once(code):
+    body = "\n".join("    " + line for line in code.splitlines())
+    env = dict(os.environ)
+    # The server refuses to import without a key, no request is made
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    result = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(code=body)],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return {"seconds": None, "rss_mb": None, "modules": None, "error": result.stderr.strip().splitlines()[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(repeat):
+    results = []
+    for name, code in scenarios():
+        runs = [run_once(code) for _ in range(repeat)]
+        ok = [run for run in runs if run["seconds"] is not None and not run["error"]]
+        results.append({
+            "scenario": name,
+            "seconds": statistics.median(run["seconds"] for run in ok) if ok else None,
+            "rss_mb": statistics.median(run["rss_mb"] for run in ok) if ok else None,
+            "modules": ok[0]["modules"] if ok else None,
+            "error": None if ok else runs[0]["error"],
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    baseline = results[0]
+    print(f"{'scenario':<24} {'import ms':>10} {'rss MB':>8} {'modules':>8}")
+    for result in results:
+        if result["error"]:
+            print(f"{result['scenario']:<24} failed: {result['error']}")
+            continue
+        # Time and memory on top of a bare interpreter
+        import_ms = (result["seconds"] - baseline["seconds"]) * 1000 if result is not baseline else result["seconds"] * 1000
+        rss = result["rss_mb"] - baseline["rss_mb"] if result is not baseline else result["rss_mb"]
+        print(f"{result['scenario']:<24} {import_ms:>10.1f} {rss:>8.1f} {result['modules']:>8}")
+
+
+if __name__ == "__main__":
+    main()
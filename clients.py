@@ -0,0 +1,107 @@
+import os
+import threading
+
+# One instance of every network client per process, created on first use. They keep connections alive
+# between calls, so tools and completions don't pay a new TCP + TLS handshake every time.
+#
+# FLOWCHAIN_HTTP_POOL_SIZE     connections kept per host (default 10)
+# FLOWCHAIN_HTTP_RETRIES       retries of failed connections and idempotent requests (default 3)
+# FLOWCHAIN_HTTP_BACKOFF       backoff factor between retries, in seconds (default 0.5)
+# FLOWCHAIN_HTTP_TIMEOUT       request timeout in seconds for plain HTTP calls (default 30)
+# FLOWCHAIN_OPENAI_RETRIES     retries of the OpenAI clients, which back off on their own (default 3)
+
+POOL_SIZE = int(os.environ.get("FLOWCHAIN_HTTP_POOL_SIZE", 10))
+RETRIES = int(os.environ.get("FLOWCHAIN_HTTP_RETRIES", 3))
+BACKOFF = float(os.environ.get("FLOWCHAIN_HTTP_BACKOFF", 0.5))
+HTTP_TIMEOUT = float(os.environ.get("FLOWCHAIN_HTTP_TIMEOUT", 30))
+OPENAI_RETRIES = int(os.environ.get("FLOWCHAIN_OPENAI_RETRIES", 3))
+
+# Retried for idempotent requests, a POST is only retried when the connection couldn't be made
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _get(name, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def _openai_limits():
+    import httpx
+    return httpx.Limits(max_connections=POOL_SIZE * 2, max_keepalive_connections=POOL_SIZE)
+
+
+def get_openai():
+    """
+    Shared synchronous OpenAI client.
+    """
+    def factory():
+        from openai import DefaultHttpxClient, OpenAI
+        return OpenAI(max_retries=OPENAI_RETRIES, http_client=DefaultHttpxClient(limits=_openai_limits()))
+    return _get("openai", factory)
+
+
+def get_async_openai():
+    """
+    Shared AsyncOpenAI client, for code running on the event loop.
+    """
+    def factory():
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        return AsyncOpenAI(max_retries=OPENAI_RETRIES, http_client=DefaultAsyncHttpxClient(limits=_openai_limits()))
+    return _get("async_openai", factory)
+
+
+def get_http_session():
+    """
+    Shared requests.Session with a keep-alive connection pool and retries with exponential backoff.
+    Pass timeout=HTTP_TIMEOUT on calls, requests has no session-wide timeout.
+    """
+    def factory():
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=RETRIES,
+            backoff_factor=BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return _get("http_session", factory)
+
+
+def get_tavily():
+    """
+    Shared Tavily client.
+    """
+    def factory():
+        from tavily import TavilyClient
+        return TavilyClient(api_key=os.getenv("TAVILY_API_KEY"))
+    return _get("tavily", factory)
+
+
+async def aclose_clients():
+    """
+    Closes the pooled connections, called when the server shuts down.
+    """
+    with _lock:
+        clients = dict(_clients)
+        _clients.clear()
+    for name, client in clients.items():
+        if name == "async_openai":
+            await client.close()
+        elif hasattr(client, "close"):
+            client.close()
@@ -0,0 +1,177 @@
+import json
+import os
+from functools import lru_cache
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # Without tiktoken fall back to the usual ~4 characters per token estimate
+    _encoding = None
+
+# Tokens the API adds around every message, and what a detail=low image costs
+MESSAGE_OVERHEAD = 4
+LOW_DETAIL_IMAGE_TOKENS = 85
+HIGH_DETAIL_IMAGE_TOKENS = 765
+
+SUMMARY_NAME = "conversation_summary"
+
+
+@lru_cache(maxsize=4096)
+def count_text_tokens(text):
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _get(message, key, default=None):
+    if isinstance(message, dict):
+        return message.get(key, default)
+    return getattr(message, key, default)
+
+
+def _to_dict(message):
+    if isinstance(message, dict):
+        return dict(message)
+    return message.model_dump(exclude_none=True)
+
+
+def count_tokens(message):
+    """
+    Estimated prompt tokens of one chat message, including images and tool calls.
+    """
+    tokens = MESSAGE_OVERHEAD
+    content = _get(message, "content")
+    if isinstance(content, str):
+        tokens += count_text_tokens(content)
+    elif isinstance(content, list):
+        for part in content:
+            if part.get("type") == "text":
+                tokens += count_text_tokens(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                detail = part.get("image_url", {}).get("detail", "auto")
+                tokens += LOW_DETAIL_IMAGE_TOKENS if detail == "low" else HIGH_DETAIL_IMAGE_TOKENS
+    for tool_call in _get(message, "tool_calls") or []:
+        function = _get(tool_call, "function")
+        tokens += count_text_tokens(_get(function, "name", "")) + count_text_tokens(_get(function, "arguments", ""))
+    return tokens
+
+
+def _text_of(message):
+    content = _get(message, "content")
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content or ""
+
+
+def extractive_summary(previous_summary, dropped, max_chars=200):
+    """
+    Local summarizer: keeps what the user asked and the gist of each reply, no model call needed.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for message in dropped:
+        role = _get(message, "role")
+        text = _text_of(message)
+        if role == "assistant" and text:
+            # Replies are JSON with a "Response" field, keep just that
+            try:
+                text = json.loads(text).get("Response", text)
+            except (ValueError, AttributeError):
+                pass
+        elif role == "tool":
+            text = f"{_get(message, 'name')} returned {text}"
+        elif role != "user":
+            continue
+        text = " ".join(str(text).split())
+        if text:
+            lines.append(f"{role}: {text[:max_chars]}")
+    return "\n".join(lines)
+
+
+class ContextManager:
+    """
+    Keeps the prompt under a token budget. Large tool outputs are trimmed (older turns harder than
+    the current one), then the oldest turns are dropped and folded into a rolling summary kept
+    right after the system prompt.
+    """
+
+    def __init__(self, budget=None, max_tool_tokens=1500, max_old_tool_tokens=300, summary_tokens=600, summarize=None):
+        self.budget = budget or int(os.environ.get("FLOWCHAIN_CONTEXT_BUDGET", 12000))
+        self.max_tool_tokens = max_tool_tokens
+        self.max_old_tool_tokens = max_old_tool_tokens
+        self.summary_tokens = summary_tokens
+        self.summarize = summarize or extractive_summary
+
+    def fit(self, messages):
+        """
+        Returns a copy of messages that fits the budget. The system prompt and the latest turn are always kept.
+        """
+        head = []
+        summary = None
+        rest = []
+        for message in messages:
+            role = _get(message, "role")
+            if role == "system" and _get(message, "name") == SUMMARY_NAME:
+                summary = message["content"]
+            elif role == "system" and not rest:
+                head.append(message)
+            else:
+                rest.append(message)
+
+        turns = self._split_turns(rest)
+        turns = [self._trim_tools(turn, last=index == len(turns) - 1) for index, turn in enumerate(turns)]
+
+        fixed = sum(count_tokens(message) for message in head)
+        sizes = [sum(count_tokens(message) for message in turn) for turn in turns]
+        dropped = []
+        # Once there is a summary, reserve its full size so folding in more turns can't overshoot
+        while len(turns) > 1 and fixed + (self.summary_tokens if summary or dropped else 0) + sum(sizes) > self.budget:
+            dropped.extend(turns.pop(0))
+            sizes.pop(0)
+
+        if dropped:
+            summary = self._cap(self.summarize(summary, dropped), self.summary_tokens, keep_end=True)
+
+        fitted = list(head)
+        if summary:
+            fitted.append({
+                "role": "system",
+                "name": SUMMARY_NAME,
+                "content": summary,
+            })
+        for turn in turns:
+            fitted.extend(turn)
+        return fitted
+
+    def count(self, messages):
+        return sum(count_tokens(message) for message in messages)
+
+    def _split_turns(self, messages):
+        # A turn starts at a user message, so tool results always stay with the call that asked for them
+        turns = []
+        for message in messages:
+            if _get(message, "role") == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    def _trim_tools(self, turn, last):
+        limit = self.max_tool_tokens if last else self.max_old_tool_tokens
+        trimmed = []
+        for message in turn:
+            if _get(message, "role") == "tool" and count_text_tokens(_get(message, "content") or "") > limit:
+                message = _to_dict(message)
+                message["content"] = self._cap(message["content"], limit)
+            trimmed.append(message)
+        return trimmed
+
+    def _cap(self, text, limit, keep_end=False):
+        if count_text_tokens(text) <= limit:
+            return text
+        # Tokens are roughly 4 characters, keep the head (or, for the rolling summary, the most recent end) and say how much was cut
+        keep = limit * 4
+        if keep_end:
+            return f"[... {len(text) - keep} earlier characters truncated]\n" + text[-keep:]
+        return text[:keep] + f"\n[... {len(text) - keep} more characters truncated]"
@@ -1,21 +1,16 @@
 from pynput import keyboard
 import os
 import json
-import tools.functions as functions
-import inspect
-from openai import OpenAI
+from clients import get_openai
 import requests
 from app_utils import *
 import datetime
-from tools.MySocalApp import create_google_calendar_event
-from tools.contacts import Contacts
-from tools.mail import Mail
-from tools.sms import SMS
-from tools.location import search_location_in_maps
-from tools.executecommand import execute_command
-from tools.executecommand import generate_and_execute_applescript
-from tools.Calendar import Calendar
-import pytesseract
+from tools.registry import load_tools
+from context_manager import ContextManager
+from tool_router import ToolRouter
+from tool_policy import local_reply
+from tool_executor import format_tool_result
+from screen_context import ContextStats, build_context
 import threading
 import time
 
@@ -24,85 +19,78 @@ if "OPENAI_API_KEY" not in os.environ:
     print("OpenAI API key is not set. Please set the OPENAI_API_KEY environment variable first.")
 
 # get openai api key from environment variable
-client = OpenAI()
+client = get_openai()
 api_key = os.environ.get("OPENAI_API_KEY")
 
-def add_functions_to_available_functions(Class):
-    class_name = Class.__name__
-    # Get all members of the functions module
-    members = inspect.getmembers(Class)
-    # load all functions from the Contacts class
-    for name, member in members:
-        # print (name)
-        # Check if the member is a method
-        if inspect.isfunction(member):
-            # Add the method to the available_functions dictionary
-            available_functions[name] = member
-
-def load_tools():
-    # load tools from tools.json
-    with open("tools/tools.json", "r") as file:
-        available_tools = json.load(file)['tools']
-
-    # Get all members of the tools module
-    members = inspect.getmembers(functions)
-    # load all functions from tools module
-    for name, member in members:
-        # Check if the member is a function
-        if inspect.isfunction(member):
-            # Add the function to the available_functions dictionary
-            available_functions[name] = member
-
-
-    # Add Contacts to available functions
-    add_functions_to_available_functions (Contacts)
-    add_functions_to_available_functions (Mail)
-    add_functions_to_available_functions (SMS)
-    add_functions_to_available_functions (Calendar)
-    available_functions['search_location_in_maps'] = search_location_in_maps
-    available_functions['execute_command'] = execute_command
-    available_functions['generate_and_execute_applescript'] = generate_and_execute_applescript
-    # add schedule_google_calendar_event from MySocalApp to available functions
-    available_functions['create_google_calendar_event'] = create_google_calendar_event
-
-    return available_tools, available_functions
+# Recent screenshots, so an unchanged screen isn't uploaded again
+frames = FrameCache()
+
+# Bytes and tokens saved by sending screen text instead of screenshots
+context_stats = ContextStats()
+
+# Bounds the history sent with every completion
+context_manager = ContextManager()
 
 # Send context to GPT-4 and ask for a list of actions
 def get_context (image, app_name, window_name):
     # print ("Preparing an response!\n")
-    base64_image = encode_image(image)
+    frame, unchanged = frames.match(image, app_name, window_name)
+    if unchanged:
+        # Same screen as a recent turn: reuse what the model said about it instead of sending the image
+        text = f"I am using {app_name} and on its {window_name}. The screen has not changed since my previous screenshot."
+        if frame["description"]:
+            text += f" Your description of it was: {frame['description']}"
+        print("Screen unchanged, not uploading the screenshot")
+        user_query = {
+            "role": "user",
+            "content": [
+                {
+                "type": "text",
+                "text": text
+                }
+            ]
+        }
+        messages.append(user_query)
+        return messages, frame
+
+    # Text-heavy windows are sent as the text read from them instead of the image, see screen_context.py
+    content, stats = build_context(image, app_name, window_name)
+    context_stats.record(stats)
+    print(f"Screen context as {stats['mode']}: {stats['sent_bytes']} bytes, ~{stats['sent_tokens']} tokens "
+          f"({stats['saved_bytes']} bytes, {stats['saved_tokens']} tokens saved vs. the image) in {stats['build_ms']} ms")
 
     user_query =  {
         "role": "user",
-        "content": [
-            {
-            "type": "text",
-            "text": f"I am using {app_name} and on its {window_name}."
-            },
-            {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/jpeg;base64,{base64_image}",
-                "detail":"low"
-            }
-            }
-        ]
+        "content": content
     }
 
     messages.append(user_query)
 
-    return messages
+    return messages, frame
+
+# Keep the model's description of a screenshot so it can stand in for the image next time
+def remember_description(frame, message):
+    if not isinstance(message, dict) or message.get("role") != "assistant" or frame["description"]:
+        return
+    try:
+        description = json.loads(message["content"]).get("Description")
+    except (TypeError, ValueError, AttributeError):
+        return
+    if description:
+        frame["description"] = description
     
 def run_conversation(messages):
     # print (messages)
     # Step 1: send the conversation and available functions to the model
     # Time the request
     start_time = time.time()
+    # Keep the prompt within the token budget, old turns are folded into a summary
+    messages[:] = context_manager.fit(messages)
     response = client.chat.completions.create(
         model="gpt-4o",
         response_format={"type": "json_object"},
         messages=messages,
-        tools=available_tools,
+        tools=tool_router.select(messages),
         tool_choice="auto",  # auto is default, but we'll be explicit
         # output json
         temperature=0,
@@ -124,6 +112,8 @@ def run_conversation(messages):
         # Step 3: call the function
         # Note: the JSON response may not always be valid; be sure to handle errors
         # Step 4: send the info for each function call and function response to the model
+        calls = []
+        function_responses = []
         for tool_call in tool_calls:
             # print (tool_call)
             function_name = tool_call.function.name
@@ -139,14 +129,11 @@ def run_conversation(messages):
                 function_response = str(e)
                 print(f"An error occurred: {e}")
 
-            # If the response is a json, convert it to a string
-            if isinstance(function_response, dict):
-                function_response = json.dumps(function_response)
-
-            # if function response is a list, then combine them into a single string
-            if isinstance(function_response, list):
-                function_response = ",".join(function_response)
+            # Tool message content must be a string: dicts, lists of dicts and ints are converted like on the server
+            function_response = format_tool_result(function_response)
 
+            calls.append((function_name, function_args))
+            function_responses.append(function_response)
             messages.append(
                 {
                     "tool_call_id": tool_call.id,
@@ -155,6 +142,17 @@ def run_conversation(messages):
                     "content": function_response,
                 }
             )  # extend conversation with function response
+        # Actions like send_sms or run_shortcut have a local reply, no second completion needed
+        reply = local_reply(calls, function_responses, available_functions)
+        if reply is not None:
+            print(">Assistant: ", reply)
+            messages.append({
+                "role": "assistant",
+                "content": reply,
+            })
+            print(f"Request took {time.time() - start_time} seconds")
+            return messages
+        messages[:] = context_manager.fit(messages)
         second_response = client.chat.completions.create(
             model="gpt-4o",
             messages=messages,
@@ -192,10 +190,10 @@ def run_conversation(messages):
 if __name__ == "__main__":
     today_date = datetime.date.today()
     
-    available_functions = {}
-    available_tools = {}
-
+    # Tool schemas and a lazy dispatch table generated from the @tool functions
     available_tools, available_functions = load_tools()
+    # Sends only the tool schemas relevant to the current turn
+    tool_router = ToolRouter(available_tools)
 
     # System prompt
     system_prompt = f'''
@@ -247,5 +245,6 @@ if __name__ == "__main__":
             )
             screenshot, app_name, window_name = get_active_window_screenshot()
             screenshot = screenshot.resize((screenshot.width, screenshot.height))
-            updated_messages = get_context(screenshot, app_name, window_name)
+            updated_messages, frame = get_context(screenshot, app_name, window_name)
             run_conversation(updated_messages)
+            remember_description(frame, messages[-1])
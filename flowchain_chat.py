@@ -1,35 +1,53 @@
-import requests
+import json
+from clients import get_http_session
 
-def chat_with_api(user_input, image_path=None):
-    url = "http://127.0.0.1:8000/api/chat"
+url = "http://127.0.0.1:8000/api/chat/stream"
+
+def chat_with_api(user_input, session_id=None, on_token=None):
+    """
+    Sends a message to the streaming chat endpoint and returns (reply, session_id).
+    on_token is called with each piece of model output as soon as it arrives.
+    """
     data = {
-        "user_input": user_input
+        "message": user_input,
+        "session_id": session_id,
     }
-    
-    files = {}
-    if image_path:
-        files["file"] = open(image_path, "rb")
 
-    response = requests.post(url, data=data, files=files)
+    # The pooled session reuses the connection to the server between messages
+    with get_http_session().post(url, json=data, stream=True) as response:
+        if response.status_code != 200:
+            print("Failed to get response")
+            print("Status code:", response.status_code)
+            print("Response:", response.text)
+            return None, session_id
 
-    if response.status_code == 200:
-        # print("Response from API:")
-        # print(response.json())
-        return response.json()
-    else:
-        print("Failed to get response")
-        print("Status code:", response.status_code)
-        print("Response:", response.text)
+        session_id = response.headers.get("X-Session-Id", session_id)
+        reply = None
+        # Server-Sent Events: every event ends with a "data: {...}" line
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if event["type"] == "token" and on_token:
+                on_token(event["content"])
+            elif event["type"] == "tool_call" and event["status"] == "started":
+                print(f"\n[running {event['name']}]")
+            elif event["type"] == "done":
+                reply = event["content"]
+            elif event["type"] == "error":
+                print("Error:", event["content"])
 
-    if image_path:
-        files["file"].close()
+    return reply, session_id
 
 if __name__ == "__main__":
+    session_id = None
     while True:
         user_input = input("\nUser: ")
         if user_input.lower() == "exit":
             break
-        
-        response = chat_with_api(user_input)
-        # print assistant's response
-        print ("\nAssistant: "+ response)
+
+        print("\nAssistant: ", end="", flush=True)
+        # print assistant's response as it streams in
+        response, session_id = chat_with_api(
+            user_input, session_id, on_token=lambda token: print(token, end="", flush=True)
+        )
@@ -1,66 +1,58 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Optional
 import os
 import json
-import inspect
-from openai import OpenAI
-from app_utils import *
+from clients import aclose_clients, get_async_openai
+from screen_context import ContextStats, build_context
+from session_store import create_session_store, new_session_id
+from tool_executor import ToolExecutor
+from tool_cache import ToolCache
+from context_manager import ContextManager
+from tool_router import ToolRouter
+from tool_policy import TurnStats, local_reply
+from agent_budget import AgentBudget
 import datetime
-import tools.functions as functions
-from tools.contacts import Contacts
-from tools.mail import Mail
-from tools.sms import SMS
-from tools.location import search_google_maps
-from tools.executecommand import execute_command, generate_and_execute_applescript
-from tools.Calendar import Calendar
-import pytesseract
+import asyncio
+from tools.registry import load_tools
+from tools.outbox import get_outbox
+from job_queue import get_queue
+from ocr import get_ocr
 import time
-from PIL import Image
 
 # Check if the key exists
 if "OPENAI_API_KEY" not in os.environ:
     raise EnvironmentError("OpenAI API key is not set. Please set the OPENAI_API_KEY environment variable first.")
 
 # Get OpenAI API key from environment variable
-client = OpenAI()
+# The async client keeps model calls from blocking the event loop, it is shared and pooled (see clients.py)
+client = get_async_openai()
 api_key = os.environ.get("OPENAI_API_KEY")
 
 app = FastAPI()
 
-available_functions = {}
-available_tools = {}
-
-def add_functions_to_available_functions(Class):
-    class_name = Class.__name__
-    members = inspect.getmembers(Class)
-    for name, member in members:
-        if inspect.isfunction(member):
-            available_functions[name] = member
-
-def load_tools():
-    with open("tools/tools.json", "r") as file:
-        available_tools = json.load(file)['tools']
-    members = inspect.getmembers(functions)
-    for name, member in members:
-        if inspect.isfunction(member):
-            available_functions[name] = member
-    add_functions_to_available_functions(Contacts)
-    add_functions_to_available_functions(Mail)
-    add_functions_to_available_functions(SMS)
-    add_functions_to_available_functions(Calendar)
-    # available_functions['search_location_in_maps'] = search_location_in_maps
-    available_functions['execute_command'] = execute_command
-    available_functions['generate_and_execute_applescript'] = generate_and_execute_applescript
-    # available_functions['execute_python_code'] = execute_python_code
-    # available_functions['generate_and_execute_python_code'] = generate_and_execute_python_code
-    available_functions['search_google_maps'] = search_google_maps
-    # available_functions['create_google_calendar_event'] = create_google_calendar_event
-    # print (available_functions)
-    return available_tools, available_functions
-
+# Tool schemas and a lazy dispatch table generated from the @tool functions (see tools/registry.py)
 available_tools, available_functions = load_tools()
 
+# Runs the tool calls of a model turn concurrently on a bounded pool, read-only tools are served from the cache
+tool_cache = ToolCache()
+# Long-running and side-effecting tools are queued as durable background jobs, see job_queue.py
+job_queue = get_queue(available_functions)
+tool_executor = ToolExecutor(available_functions, cache=tool_cache, jobs=job_queue)
+
+# Bounds the history sent with every completion (FLOWCHAIN_CONTEXT_BUDGET tokens)
+context_manager = ContextManager()
+
+# Sends only the tool schemas relevant to the current turn
+tool_router = ToolRouter(available_tools)
+
+# Model round trips per user turn
+turn_stats = TurnStats()
+
+# Bytes and tokens saved by sending screen text instead of screenshots
+context_stats = ContextStats()
+
 today_date = datetime.date.today()
 
 system_prompt = f'''
@@ -75,7 +67,7 @@ You are an action recommendation assistant on macOS. You can do anything user as
 6. Use the `run_shortcut` function to execute any shortcut on the user's machine (e.g., `run_shortcut("Start Pomodoro")` starts a Pomodoro timer).
 7. If a user query can be fulfilled by an AppleScript, generate the necessary code to execute the action and then call the `execute_command` function to run the code.
 8. Always recommend more relevant actions to take after completing an action.
-9. 
+9. A task can take several tool calls in a row (e.g. look up a contact, then email them). Request the calls that don't depend on each other together in one step, they run in parallel.
 
 Respond in ONLY JSON format with the following key-value pairs:
 - Response: Provide a response to the user's query based on the context.
@@ -103,137 +95,223 @@ system_message = {
     ]
 }
 
-messages = [system_message]
+# Conversation histories, one per client session
+# Old turns are folded into the context manager's summary rather than dropped by count
+sessions = create_session_store(system_message, fit=context_manager.fit)
 
 # Send context to GPT-4 and ask for a list of actions
-def get_context (image, app_name=None, window_name=None):
-    global messages
-
+def get_context (messages, image, app_name=None, window_name=None):
     # print ("Preparing an response!\n")
-    base64_image = encode_image(image)
+    # Text-heavy windows are sent as the text read from them instead of the image, see screen_context.py
+    content, stats = build_context(image, app_name, window_name)
+    context_stats.record(stats)
+    print(f"Screen context as {stats['mode']}: {stats['sent_bytes']} bytes, ~{stats['sent_tokens']} tokens in {stats['build_ms']} ms")
 
     user_query =  {
         "role": "user",
-        "content": [
-            {
-            "type": "text",
-            "text": f"I am using {app_name} and on its {window_name}."
-            },
-            {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:image/jpeg;base64,{base64_image}",
-                "detail":"low"
-            }
-            }
-        ]
+        "content": content
     }
 
     messages.append(user_query)
 
     return messages
     
-def run_conversation(messages):
-    # print (messages)
-    # Step 1: send the conversation and available functions to the model
+def completion_kwargs(messages, budget):
+    """
+    Arguments of the next completion in the agent loop. Tools are offered until a budget runs out,
+    then the model has to answer with what it has.
+    """
+    kwargs = {
+        "model": "gpt-4o",
+        "response_format": {"type": "json_object"},
+        "messages": messages,
+        "temperature": 0,
+    }
+    if budget.exhausted() is None:
+        kwargs["tools"] = tool_router.select(messages)
+        kwargs["tool_choice"] = "auto"  # auto is default, but we'll be explicit
+    return kwargs
+
+async def run_conversation(messages):
+    """
+    Agent loop: calls the model, runs the tool calls it asks for and repeats until it answers,
+    within the step, token and wall-clock budget of the turn.
+    """
     # Time the request
     start_time = time.time()
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        response_format={"type": "json_object"},
-        messages=messages,
-        tools=available_tools,
-        tool_choice="auto",  # auto is default, but we'll be explicit
-        # output json
-        temperature=0,
-    )
-
-    # pop the last message from the messages to conserve context windows.
-    messages.pop()
-
-    response_message = response.choices[0].message
+    budget = AgentBudget()
+    reply = None
+    stop_reason = "answered"
+    while True:
+        # Keep the prompt within the token budget, old turns are folded into a summary
+        messages[:] = context_manager.fit(messages)
+        kwargs = completion_kwargs(messages, budget)
+        response = await client.chat.completions.create(**kwargs)
+        budget.record(response.usage.total_tokens if response.usage else context_manager.count(messages))
+        response_message = response.choices[0].message
+
+        tool_calls = response_message.tool_calls if "tools" in kwargs else None
+        if not tool_calls:
+            if response_message.content is not None:
+                print(">Assistant: ", response_message.content)
+                # Add assistant's response to the conversation
+                messages.append({
+                    "role": "assistant",
+                    "content": response_message.content,
+                })
+            break
 
-    # print (response_message)
-
-    tool_calls = response_message.tool_calls
-    
-    # Step 2: check if the model wanted to call a function
-    # messages.append(response_message)  # extsend conversation with assistant's reply
-    if tool_calls:
         messages.append(response_message)
-        # Step 3: call the function
-        # Note: the JSON response may not always be valid; be sure to handle errors
-        # Step 4: send the info for each function call and function response to the model
-        for tool_call in tool_calls:
-            # print (tool_call)
-            function_name = tool_call.function.name
-            function_to_call = available_functions[function_name]
-            function_args = json.loads(tool_call.function.arguments)
-
-            # print("Calling function: ", function_name)
-
-            # catch error and just append the error to the messages
-            try:
-                function_response = function_to_call(**function_args)
-            except Exception as e:
-                function_response = str(e)
-                print(f"An error occurred: {e}")
-
-            # If the response is a json, convert it to a string
-            if isinstance(function_response, dict):
-                function_response = json.dumps(function_response)
-
-            # print (function_response)
-            # # if function response is a list, then combine them into a single string
-            if isinstance(function_response, list):
-                # if the response is a list of dictionaries, convert them to strings
-                for i, response in enumerate(function_response):
-                    if isinstance(response, dict):
-                        function_response[i] = json.dumps(response)
-                # else convert the list to a string
-                function_response = ",".join(function_response)
-
+        # The model requests independent calls together, they run concurrently and results keep the tool_call order
+        calls = [(tool_call.function.name, tool_call.function.arguments) for tool_call in tool_calls]
+        function_responses = await tool_executor.run_all(calls)
+        for tool_call, function_response in zip(tool_calls, function_responses):
             messages.append(
                 {
                     "tool_call_id": tool_call.id,
                     "role": "tool",
-                    "name": function_name,
+                    "name": tool_call.function.name,
                     "content": function_response,
                 }
             )  # extend conversation with function response
-        second_response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-        )  # get a new response from the model where it can see the function response
-        second_message = second_response.choices[0]
-        if second_message.message.content:
-            # print("Response from the model after function call:")
-            print(">Assistant: ", second_message.message.content)
-        # print(second_message)
-        # append the new message to the conversation
-            # Prepare assistant message to append to the conversation
-            assistant_message = {
-                "role": "assistant",
-                "content": second_message.message.content,
-            }
-            messages.append(assistant_message)
-    else:
-        if response_message.content is not None:
-            # print("Response from the model: \n") 
-            print(">Assistant: ", response_message.content)
-            
-            # Add assistant's response to the conversation
-            assistant_message = {
+        # Actions like send_sms or run_shortcut have a local reply, no further completion needed
+        reply = local_reply(calls, function_responses, available_functions)
+        if reply is not None:
+            print(">Assistant: ", reply)
+            messages.append({
                 "role": "assistant",
-                "content": response_message.content,
-            }
-            messages.append(assistant_message)
-    end_time = time.time()
-    print(f"Request took {end_time - start_time} seconds")
-
-    # print (messages)
+                "content": reply,
+            })
+            stop_reason = "local_reply"
+            break
+        stop_reason = budget.exhausted() or stop_reason
+
+    turn_stats.record(budget.steps, local=reply is not None)
+    print(f"Request took {time.time() - start_time} seconds, {budget.steps} model round trips ({stop_reason})")
     return messages
 
+async def stream_completion(**kwargs):
+    """
+    Streams a chat completion. Yields ("token", text) for each content delta as it arrives,
+    then ("usage", total_tokens) and a final ("message", assistant_message) with the content
+    and tool calls reassembled.
+    """
+    stream = await client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+    content = []
+    tool_calls = {}
+    total_tokens = None
+    async for chunk in stream:
+        # The last chunk has no choices, only the usage of the whole completion
+        if chunk.usage:
+            total_tokens = chunk.usage.total_tokens
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content.append(delta.content)
+            yield "token", delta.content
+        # Tool calls arrive in fragments, the index tells which call a fragment belongs to
+        for fragment in delta.tool_calls or []:
+            tool_call = tool_calls.setdefault(fragment.index, {
+                "id": None,
+                "type": "function",
+                "function": {"name": "", "arguments": ""},
+            })
+            if fragment.id:
+                tool_call["id"] = fragment.id
+            if fragment.function:
+                tool_call["function"]["name"] += fragment.function.name or ""
+                tool_call["function"]["arguments"] += fragment.function.arguments or ""
+
+    assistant_message = {
+        "role": "assistant",
+        "content": "".join(content) if content else None,
+    }
+    if tool_calls:
+        assistant_message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+    yield "usage", total_tokens
+    yield "message", assistant_message
+
+async def stream_conversation(messages):
+    """
+    Same agent loop as run_conversation, but yields events as soon as they are available:
+    model tokens, tool call progress and a final "done" event with the full reply.
+    """
+    start_time = time.time()
+    budget = AgentBudget()
+    reply = None
+    stop_reason = "answered"
+    while True:
+        messages[:] = context_manager.fit(messages)
+        kwargs = completion_kwargs(messages, budget)
+        response_message = None
+        total_tokens = None
+        async for kind, data in stream_completion(**kwargs):
+            if kind == "token":
+                yield {"type": "token", "content": data}
+            elif kind == "usage":
+                total_tokens = data
+            else:
+                response_message = data
+        budget.record(total_tokens or context_manager.count(messages))
+
+        tool_calls = response_message.get("tool_calls") if "tools" in kwargs else None
+        if not tool_calls:
+            break
+
+        if response_message["content"] is None:
+            del response_message["content"]
+        messages.append(response_message)
+        tasks = {}
+        for tool_call in tool_calls:
+            function_name = tool_call["function"]["name"]
+            yield {"type": "tool_call", "status": "started", "id": tool_call["id"], "name": function_name, "step": budget.steps}
+            tasks[tool_call["id"]] = asyncio.ensure_future(
+                tool_executor.run(function_name, tool_call["function"]["arguments"])
+            )
+        # Report each call as soon as it finishes, but add the results in the original order
+        pending = set(tasks.values())
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for tool_call in tool_calls:
+                if tasks[tool_call["id"]] in done:
+                    yield {"type": "tool_call", "status": "finished", "id": tool_call["id"], "name": tool_call["function"]["name"], "step": budget.steps}
+        for tool_call in tool_calls:
+            messages.append(
+                {
+                    "tool_call_id": tool_call["id"],
+                    "role": "tool",
+                    "name": tool_call["function"]["name"],
+                    "content": tasks[tool_call["id"]].result(),
+                }
+            )
+        # Actions with a local reply end the turn without another completion
+        calls = [(tool_call["function"]["name"], tool_call["function"]["arguments"]) for tool_call in tool_calls]
+        reply = local_reply(calls, [tasks[tool_call["id"]].result() for tool_call in tool_calls], available_functions)
+        if reply is not None:
+            yield {"type": "token", "content": reply}
+            response_message = {"role": "assistant", "content": reply}
+            stop_reason = "local_reply"
+            break
+        stop_reason = budget.exhausted() or stop_reason
+
+    if response_message.get("content"):
+        messages.append({
+            "role": "assistant",
+            "content": response_message["content"],
+        })
+        print(">Assistant: ", response_message["content"])
+
+    turn_stats.record(budget.steps, local=reply is not None)
+    print(f"Request took {time.time() - start_time} seconds, {budget.steps} model round trips ({stop_reason})")
+    yield {
+        "type": "done",
+        "content": response_message.get("content"),
+        "round_trips": budget.steps,
+        "stop_reason": stop_reason,
+        "budget": budget.stats(),
+    }
+
 # @app.post("/api/chat")
 # async def chat(user_input: str = Form(...)):
 #     global messages
@@ -265,22 +343,116 @@ def run_conversation(messages):
 
 class ChatRequest(BaseModel):
     message: str
+    session_id: Optional[str] = None
 
 @app.post("/api/chat")
-async def chat(request: ChatRequest):
-    global messages
-    user_input = request.message
-    messages.append({
-        "role": "user",
-        "content": user_input,
-    })
-
-    # Run the conversation (you need to implement this function)
-    messages = run_conversation(messages)
+async def chat(request: ChatRequest, response: Response):
+    session_id = request.session_id or new_session_id()
+    response.headers["X-Session-Id"] = session_id
+
+    # Turns of the same session are serialized, different sessions never wait on each other
+    async with sessions.lock(session_id):
+        messages = sessions.get(session_id)
+        messages.append({
+            "role": "user",
+            "content": request.message,
+        })
+
+        # Run the conversation
+        messages = await run_conversation(messages)
+        sessions.save(session_id, messages)
 
     # Get the last assistant message
     assistant_message = messages[-1]
 
     # return {"response": assistant_message["content"]}
     print (assistant_message["content"])
-    return assistant_message["content"]
\ No newline at end of file
+    return assistant_message["content"]
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Server-Sent Events version of /api/chat. Each event carries a JSON payload:
+    "token" events with model output, "tool_call" progress events and a final "done" event.
+    """
+    session_id = request.session_id or new_session_id()
+
+    async def events():
+        async with sessions.lock(session_id):
+            messages = sessions.get(session_id)
+            messages.append({
+                "role": "user",
+                "content": request.message,
+            })
+            try:
+                async for event in stream_conversation(messages):
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                yield f"event: error\ndata: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
+                return
+            sessions.save(session_id, messages)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"X-Session-Id": session_id, "Cache-Control": "no-cache"},
+    )
+
+@app.delete("/api/chat/{session_id}")
+def end_session(session_id: str):
+    sessions.delete(session_id)
+    return {"session_id": session_id, "deleted": True}
+
+@app.get("/api/outbox")
+def outbox_jobs():
+    return {"jobs": get_outbox().jobs()}
+
+@app.get("/api/outbox/{job_id}")
+def outbox_job(job_id: str):
+    job = get_outbox().status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No email job with id {job_id}")
+    return job
+
+@app.get("/api/jobs")
+def list_jobs(status: Optional[str] = None, limit: int = 50):
+    return {"jobs": job_queue.jobs(limit, status)}
+
+@app.get("/api/jobs/{job_id}")
+def job_status(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    return job
+
+@app.get("/api/jobs/{job_id}/result")
+def job_result(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    if job["status"] not in ("succeeded", "failed"):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job['status']}")
+    return {"id": job_id, "status": job["status"], "result": job["result"], "error": job["error"]}
+
+@app.post("/api/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job with id {job_id}")
+    return job
+
+@app.get("/api/stats")
+def stats():
+    return {"tool_cache": tool_cache.stats(), "turns": turn_stats.stats(), "screen_context": context_stats.stats()}
+
+@app.on_event("startup")
+async def startup():
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    job_queue.stop()
+    tool_executor.shutdown()
+    get_ocr().shutdown()
+    await aclose_clients()
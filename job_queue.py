@@ -0,0 +1,233 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from tool_executor import format_tool_result
+
+CACHE_DIR = os.path.expanduser(os.environ.get("FLOWCHAIN_CACHE_DIR", "~/.flowchain"))
+
+# Job states: queued -> running -> succeeded | failed, queued or running jobs can be cancelled.
+# A job that raises is queued again with exponential backoff until it runs out of attempts. Background
+# tools have side effects, so a job gets one attempt unless its tool opts in with @tool(attempts=...).
+FINISHED = ("succeeded", "failed", "cancelled")
+
+COLUMNS = (
+    "id", "tool", "arguments", "status", "result", "error",
+    "attempts", "max_attempts", "created_at", "updated_at", "run_after", "owner",
+)
+
+
+def _alive(pid):
+    # Whether a process with this pid still exists, e.g. another server worker sharing the database
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Durable queue for tools that take long or have side effects (@tool(background=True)).
+    Jobs are stored in SQLite so queued work survives a restart, and run on a pool of worker
+    threads while the chat request returns as soon as the job is accepted.
+    """
+
+    def __init__(self, path, functions, workers=2, max_attempts=1, backoff=2.0, keep_seconds=7 * 24 * 3600):
+        self.path = path
+        self.functions = functions
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.keep_seconds = keep_seconds
+        self._mutex = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, tool TEXT NOT NULL, arguments TEXT NOT NULL, status TEXT NOT NULL, "
+            "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, run_after REAL NOT NULL, owner INTEGER)"
+        )
+        if "owner" not in [column[1] for column in self._conn.execute("PRAGMA table_info(jobs)")]:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_run_after ON jobs (status, run_after)")
+        # Jobs that were running when their process stopped may have had side effects, they are not run
+        # again. Several processes can share the database, jobs of the ones still alive are left alone
+        running = self._conn.execute("SELECT id, owner FROM jobs WHERE status = 'running'").fetchall()
+        orphans = [(job_id,) for job_id, owner in running if owner is None or owner == os.getpid() or not _alive(owner)]
+        self._conn.executemany(
+            "UPDATE jobs SET status = 'failed', error = 'Interrupted by a server restart', updated_at = ? "
+            "WHERE id = ? AND status = 'running'",
+            [(time.time(), job_id) for job_id, in orphans],
+        )
+        self._conn.commit()
+
+    def start(self):
+        with self._mutex:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for index in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stopped = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def submit(self, tool, arguments, max_attempts=None):
+        """
+        Queues a tool call and returns the job record.
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex[:12]
+        with self._mutex:
+            self._conn.execute(
+                "INSERT INTO jobs (id, tool, arguments, status, attempts, max_attempts, created_at, updated_at, run_after) "
+                "VALUES (?, ?, ?, 'queued', 0, ?, ?, ?, ?)",
+                (job_id, tool, json.dumps(arguments), max_attempts or self.max_attempts, now, now, now),
+            )
+            self._conn.execute(
+                "DELETE FROM jobs WHERE updated_at < ? AND status IN ('succeeded', 'failed', 'cancelled')",
+                (now - self.keep_seconds,),
+            )
+            self._conn.commit()
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        with self._mutex:
+            row = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._job(row) if row else None
+
+    def jobs(self, limit=50, status=None):
+        query = f"SELECT {', '.join(COLUMNS)} FROM jobs"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        with self._mutex:
+            rows = self._conn.execute(query + " ORDER BY created_at DESC LIMIT ?", params + (limit,)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued or running job. A running tool can't be interrupted, it finishes
+        in the background but its result is discarded. Returns the job, or None if unknown.
+        """
+        with self._mutex:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+            self._conn.commit()
+        return self.get(job_id)
+
+    def _job(self, row):
+        job = dict(zip(COLUMNS, row))
+        job["arguments"] = json.loads(job["arguments"])
+        return job
+
+    def _claim(self):
+        # Claims the oldest due job. The status check in the UPDATE keeps two workers, or two processes
+        # sharing the database, from taking the same one: only the one whose UPDATE changed the row runs it
+        now = time.time()
+        with self._mutex:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ? ORDER BY created_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                next_row = self._conn.execute(
+                    "SELECT MIN(run_after) FROM jobs WHERE status = 'queued'"
+                ).fetchone()
+                return None, next_row[0]
+            claimed = self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?, owner = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (now, os.getpid(), row[0]),
+            ).rowcount
+            self._conn.commit()
+        if claimed != 1:
+            # Another process took it first, look again right away
+            return None, now
+        return self.get(row[0]), None
+
+    def _finish(self, job, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self._mutex:
+            # A job cancelled while it was running stays cancelled
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND status = 'running'",
+                tuple(fields.values()) + (job["id"],),
+            )
+            self._conn.commit()
+
+    def _run(self):
+        while not self._stopped:
+            job, next_run = self._claim()
+            if job is None:
+                timeout = 5 if next_run is None else max(0.05, min(5, next_run - time.time()))
+                with self._wakeup:
+                    self._wakeup.wait(timeout)
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        function = self.functions.get(job["tool"])
+        if function is None:
+            self._finish(job, status="failed", error=f"Unknown tool: {job['tool']}")
+            return
+        try:
+            result = format_tool_result(function(**job["arguments"]))
+        except Exception as e:
+            print(f"Job {job['id']} ({job['tool']}) failed: {e}")
+            if job["attempts"] < job["max_attempts"]:
+                delay = self.backoff * 2 ** (job["attempts"] - 1)
+                self._finish(job, status="queued", error=str(e), run_after=time.time() + delay)
+                with self._wakeup:
+                    self._wakeup.notify()
+            else:
+                self._finish(job, status="failed", error=str(e))
+            return
+        self._finish(job, status="succeeded", result=result, error=None)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue(functions=None):
+    """
+    Process-wide job queue. FLOWCHAIN_JOB_DB sets the database (default ~/.flowchain/jobs.db),
+    FLOWCHAIN_JOB_WORKERS the worker threads and FLOWCHAIN_JOB_ATTEMPTS the attempts of jobs
+    whose tool doesn't set them.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            if functions is None:
+                from tools.registry import load_tools
+                functions = load_tools()[1]
+            _queue = JobQueue(
+                os.environ.get("FLOWCHAIN_JOB_DB", os.path.join(CACHE_DIR, "jobs.db")),
+                functions,
+                workers=int(os.environ.get("FLOWCHAIN_JOB_WORKERS", 2)),
+                max_attempts=int(os.environ.get("FLOWCHAIN_JOB_ATTEMPTS", 1)),
+            )
+        return _queue
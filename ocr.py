@@ -0,0 +1,240 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# OCR of screenshots and photos. Images are converted to grayscale and downscaled on the calling
+# thread (cheap, done by PIL in C), then binarized, split into text regions and read by Tesseract
+# in a process pool. Results are cached by a hash of the grayscale pixels, so the same screen is
+# only read once.
+#
+# FLOWCHAIN_OCR_WORKERS  processes running Tesseract (default 2)
+# FLOWCHAIN_OCR_LANG     Tesseract languages, e.g. "eng+deu" (default eng)
+
+# Longest side Tesseract gets. Retina screenshots are bigger than needed to read UI text
+MAX_SIDE = 2400
+
+# Rows of a region are merged when the gap between them is at most this, in pixels
+LINE_GAP = 12
+MIN_REGION_HEIGHT = 6
+# Regions where more than this share of the pixels is ink are pictures, not text
+MAX_INK = 0.45
+
+
+def prepare(image, max_side=MAX_SIDE):
+    """
+    Grayscale copy of the image, downscaled so its longest side is at most max_side.
+    """
+    from PIL import Image
+    if image.mode in ("RGBA", "LA", "PA") and image.getchannel("A").getextrema()[0] < 255:
+        # Transparent pixels would turn black, put them on white first
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image.convert("RGBA"), mask=image.getchannel("A"))
+        image = background
+    image = image.convert("L")
+    scale = max_side / max(image.size)
+    if scale < 1:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS, reducing_gap=2.0)
+    return image
+
+
+def otsu_threshold(histogram):
+    # Threshold maximizing the variance between the two classes of a 256-bin histogram
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background = weighted = 0
+    best, threshold = -1, 127
+    for level, count in enumerate(histogram):
+        background += count
+        if background == 0:
+            continue
+        foreground = total - background
+        if foreground == 0:
+            break
+        weighted += level * count
+        mean_background = weighted / background
+        mean_foreground = (weighted_total - weighted) / foreground
+        variance = background * foreground * (mean_background - mean_foreground) ** 2
+        if variance > best:
+            best, threshold = variance, level
+    return threshold
+
+
+def binarize(gray):
+    """
+    Black text on white. Dark mode windows are inverted first.
+    """
+    from PIL import ImageOps
+    histogram = gray.histogram()
+    threshold = otsu_threshold(histogram)
+    dark = sum(histogram[:threshold + 1])
+    if dark > sum(histogram) / 2:
+        # Mostly dark pixels: light text on a dark background
+        gray = ImageOps.invert(gray)
+        threshold = 255 - threshold
+    return gray.point(lambda value: 255 if value > threshold else 0, mode="L")
+
+
+def text_regions(binary, line_gap=LINE_GAP):
+    """
+    (left, top, right, bottom) boxes around blocks of text, from the row and column profiles of the
+    inked pixels. Blank space and pictures are left out, so Tesseract only reads the text.
+    """
+    from PIL import Image, ImageOps
+    ink = ImageOps.invert(binary)
+    # Shrinking each row to strips of 32 pixels (in C) keeps a few inked pixels from averaging out to zero
+    strips = ink.resize((max(1, ink.width // 32), ink.height), Image.BOX)
+    width, pixels = strips.width, strips.tobytes()
+    regions = []
+    top = None
+    last_inked = None
+    for y in range(ink.height):
+        if any(pixels[y * width:(y + 1) * width]):
+            if top is None:
+                top = y
+            last_inked = y
+        elif top is not None and y - last_inked > line_gap:
+            regions.append((top, last_inked + 1))
+            top = None
+    if top is not None:
+        regions.append((top, last_inked + 1))
+
+    boxes = []
+    for top, bottom in regions:
+        if bottom - top < MIN_REGION_HEIGHT:
+            continue
+        band = ink.crop((0, top, ink.width, bottom))
+        box = band.getbbox()
+        if box is None:
+            continue
+        left, _, right, _ = box
+        inked = band.crop((left, 0, right, bottom - top)).histogram()[255]
+        if inked > MAX_INK * (right - left) * (bottom - top):
+            continue
+        # A little white margin helps Tesseract with the first and last characters
+        boxes.append((max(0, left - 4), max(0, top - 4), min(ink.width, right + 4), min(ink.height, bottom + 4)))
+    return boxes
+
+
+def _recognize(size, pixels, lang):
+    # Runs in a pool process: binarize, find the text regions and read them
+    import pytesseract
+    from PIL import Image
+    binary = binarize(Image.frombytes("L", size, pixels))
+    boxes = text_regions(binary)
+    if not boxes:
+        return ""
+    # The regions are stacked on one compact page, so Tesseract (a new process per call) runs once
+    # and never scans blank space or pictures
+    gap = 8
+    page = Image.new("L", (max(right - left for left, _, right, _ in boxes), sum(bottom - top + gap for _, top, _, bottom in boxes)), 255)
+    y = 0
+    for box in boxes:
+        page.paste(binary.crop(box), (0, y))
+        y += box[3] - box[1] + gap
+    # Page segmentation mode 4: a single column of text of variable sizes
+    return pytesseract.image_to_string(page, lang=lang, config="--psm 4").strip()
+
+
+class OCR:
+    """
+    Text of images, read in a process pool and cached by image content.
+    """
+
+    def __init__(self, workers=2, lang="eng", max_entries=64):
+        self.workers = workers
+        self.lang = lang
+        self.max_entries = max_entries
+        self._pool = None
+        self._cache = OrderedDict()  # pixel hash -> text
+        self._pending = {}  # pixel hash -> Future, so the same image isn't read twice at once
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.ocr_ms = 0.0
+
+    def _key(self, gray):
+        digest = hashlib.blake2b(gray.tobytes(), digest_size=16)
+        digest.update(f"{gray.size}{self.lang}".encode())
+        return digest.hexdigest()
+
+    def submit(self, image):
+        """
+        Starts reading the image and returns a concurrent.futures.Future with its text.
+        """
+        gray = prepare(image)
+        key = self._key(gray)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(self._cache[key])
+                return future
+            if key in self._pending:
+                self.hits += 1
+                return self._pending[key]
+            self.misses += 1
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            started = time.perf_counter()
+            future = self._pool.submit(_recognize, gray.size, gray.tobytes(), self.lang)
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._store(key, done, started))
+        return future
+
+    def _store(self, key, future, started):
+        with self._lock:
+            self._pending.pop(key, None)
+            self.ocr_ms += (time.perf_counter() - started) * 1000
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._cache[key] = future.result()
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def text(self, image, timeout=60):
+        """
+        Text of the image. Blocks the calling thread only, the OCR itself runs in another process.
+        """
+        return self.submit(image).result(timeout)
+
+    async def atext(self, image, timeout=60):
+        """
+        Text of the image for async code. Preparing the image runs on a worker thread too.
+        """
+        import asyncio
+        future = await asyncio.to_thread(self.submit, image)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._cache),
+                "average_ocr_ms": round(self.ocr_ms / self.misses, 1) if self.misses else 0,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+_ocr = None
+_ocr_lock = threading.Lock()
+
+
+def get_ocr():
+    global _ocr
+    with _ocr_lock:
+        if _ocr is None:
+            _ocr = OCR(
+                workers=int(os.environ.get("FLOWCHAIN_OCR_WORKERS", 2)),
+                lang=os.environ.get("FLOWCHAIN_OCR_LANG", "eng"),
+            )
+        return _ocr
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+
+from app_utils import encode_image_data_url, run_applescript_capture
+from context_manager import LOW_DETAIL_IMAGE_TOKENS, count_text_tokens
+
+# Builds the screen part of a user turn. The window title and app always go as text; the screenshot
+# goes either as an image or as the text read from it, whichever fits the window:
+#   - apps whose content is visual (photos, maps, design tools) always send the image
+#   - text-heavy windows (mail, editors, browsers, terminals) send the OCR text
+#   - otherwise the smaller payload wins, the image when too little text was found
+#
+# FLOWCHAIN_CONTEXT_MODE         auto, text or image (default auto)
+# FLOWCHAIN_CONTEXT_TEXT_TOKENS  most tokens of screen text sent in one turn (default 1500)
+
+TEXT_APPS = {
+    "Mail", "Messages", "Notes", "TextEdit", "Pages", "Microsoft Word", "Microsoft Outlook",
+    "Safari", "Google Chrome", "Firefox", "Arc", "Microsoft Edge", "Brave Browser",
+    "Xcode", "Code", "Visual Studio Code", "Cursor", "Sublime Text", "PyCharm",
+    "Terminal", "iTerm2", "Slack", "Discord", "Calendar", "Reminders", "Obsidian", "Notion",
+}
+
+VISUAL_APPS = {
+    "Photos", "Preview", "Maps", "Figma", "Sketch", "Pixelmator Pro", "Photoshop",
+    "QuickTime Player", "FaceTime", "Keynote", "Freeform",
+}
+
+# Windows with less text than this are described by the image
+MIN_TEXT_CHARS = 40
+
+# How the current tab's address is read from browsers, it says more about the page than the title
+BROWSER_URL_SCRIPTS = {
+    "Safari": 'tell application "Safari" to return URL of front document',
+    "Google Chrome": 'tell application "Google Chrome" to return URL of active tab of front window',
+    "Arc": 'tell application "Arc" to return URL of active tab of front window',
+    "Microsoft Edge": 'tell application "Microsoft Edge" to return URL of active tab of front window',
+    "Brave Browser": 'tell application "Brave Browser" to return URL of active tab of front window',
+}
+
+
+def window_metadata(app_name, window_name):
+    """
+    One line describing the active window: the app, the window title and the browser URL if any.
+    """
+    text = f"I am using {app_name} and on its {window_name}."
+    script = BROWSER_URL_SCRIPTS.get(app_name)
+    if script:
+        stdout, stderr = run_applescript_capture(script)
+        if stdout.strip() and not stderr:
+            text += f" The page address is {stdout.strip()}."
+    return text
+
+
+def truncate_tokens(text, max_tokens):
+    if count_text_tokens(text) <= max_tokens:
+        return text
+    # About 4 characters per token, then trimmed until it fits
+    text = text[:max_tokens * 4]
+    while text and count_text_tokens(text) > max_tokens:
+        text = text[:int(len(text) * 0.9)]
+    return text + "\n[...]"
+
+
+def build_context(image, app_name=None, window_name=None, mode=None, max_text_tokens=None, ocr_timeout=10):
+    """
+    Content parts of a user message describing the active window, and stats of the choice: the
+    mode used, the bytes and estimated tokens sent, and what sending the image would have cost.
+    """
+    from ocr import get_ocr
+    mode = mode or os.environ.get("FLOWCHAIN_CONTEXT_MODE", "auto")
+    max_text_tokens = max_text_tokens or int(os.environ.get("FLOWCHAIN_CONTEXT_TEXT_TOKENS", 1500))
+    started = time.perf_counter()
+
+    metadata = window_metadata(app_name, window_name)
+    image_url, image_stats = encode_image_data_url(image, detail="low")
+    stats = {
+        "image_bytes": image_stats["payload_bytes"],
+        "image_tokens": LOW_DETAIL_IMAGE_TOKENS,
+    }
+
+    text = ""
+    if mode == "text" or (mode == "auto" and app_name not in VISUAL_APPS):
+        try:
+            text = get_ocr().text(image, timeout=ocr_timeout).strip()
+        except Exception as e:
+            # No Tesseract, or it took too long: the image still works
+            print(f"OCR failed, sending the screenshot: {e}")
+
+    if mode == "text" and text:
+        use_text = True
+    elif mode == "auto" and len(text) >= MIN_TEXT_CHARS:
+        # Text-heavy windows always read better as text, others by the smaller payload
+        use_text = app_name in TEXT_APPS or len(text.encode()) < image_stats["payload_bytes"]
+    else:
+        use_text = False
+
+    if use_text:
+        text = truncate_tokens(text, max_text_tokens)
+        screen_text = f"{metadata} The text on the screen reads:\n{text}"
+        content = [{"type": "text", "text": screen_text}]
+        stats.update(mode="text", sent_bytes=len(screen_text.encode()), sent_tokens=count_text_tokens(screen_text))
+    else:
+        content = [
+            {"type": "text", "text": metadata},
+            {"type": "image_url", "image_url": {"url": image_url, "detail": "low"}},
+        ]
+        stats.update(
+            mode="image",
+            sent_bytes=len(metadata.encode()) + image_stats["payload_bytes"],
+            sent_tokens=count_text_tokens(metadata) + LOW_DETAIL_IMAGE_TOKENS,
+        )
+
+    # Compared with what every turn used to send: the title line and the image. A detail=low image is a
+    # flat 85 tokens but unreadable for small text, so text mode usually saves bytes and costs tokens
+    baseline_bytes = len(metadata.encode()) + image_stats["payload_bytes"]
+    baseline_tokens = count_text_tokens(metadata) + LOW_DETAIL_IMAGE_TOKENS
+    stats.update(
+        saved_bytes=baseline_bytes - stats["sent_bytes"],
+        saved_tokens=baseline_tokens - stats["sent_tokens"],
+        build_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+    return content, stats
+
+
+class ContextStats:
+    """
+    Totals of build_context over the turns: how often each mode was used and the bytes and tokens saved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = {"text": 0, "image": 0}
+        self.sent_bytes = 0
+        self.saved_bytes = 0
+        self.saved_tokens = 0
+
+    def record(self, stats):
+        with self._lock:
+            self.turns[stats["mode"]] += 1
+            self.sent_bytes += stats["sent_bytes"]
+            self.saved_bytes += stats["saved_bytes"]
+            self.saved_tokens += stats["saved_tokens"]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "turns": dict(self.turns),
+                "sent_bytes": self.sent_bytes,
+                "saved_bytes": self.saved_bytes,
+                "saved_tokens": self.saved_tokens,
+            }
@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+from context_manager import SUMMARY_NAME
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def _to_jsonable(message):
+    # Assistant messages returned by the OpenAI client are pydantic models, dump them to plain dicts
+    if hasattr(message, "model_dump"):
+        return message.model_dump(exclude_none=True)
+    raise TypeError(f"Object of type {type(message).__name__} is not JSON serializable")
+
+
+def trim_messages(messages, max_messages):
+    """
+    Keeps the leading system message(s) plus the most recent messages, up to max_messages in total.
+    The kept history always starts at a user message so tool results are never separated from
+    the assistant message that requested them.
+    """
+    if max_messages is None or len(messages) <= max_messages:
+        return messages
+
+    head = []
+    for message in messages:
+        if _role(message) != "system":
+            break
+        head.append(message)
+
+    tail = messages[len(head):][-(max_messages - len(head)):] if max_messages > len(head) else []
+    while tail and _role(tail[0]) != "user":
+        tail.pop(0)
+    return head + tail
+
+
+def _role(message):
+    if isinstance(message, dict):
+        return message.get("role")
+    return getattr(message, "role", None)
+
+
+def _is_prompt(message):
+    # The system prompt, as opposed to the rolling summary the context manager keeps as a system message
+    name = message.get("name") if isinstance(message, dict) else getattr(message, "name", None)
+    return _role(message) == "system" and name != SUMMARY_NAME
+
+
+class SessionStore:
+    """
+    In-memory conversation store keyed by session id.
+    Sessions are evicted least-recently-used once there are more than max_sessions,
+    and expire after ttl_seconds without being touched. Histories are bounded with fit
+    (ContextManager.fit, which folds old turns into a summary) when given, otherwise by max_messages.
+    """
+
+    def __init__(self, system_message, max_sessions=1000, ttl_seconds=3600, max_messages=50, fit=None):
+        self.system_message = system_message
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self.fit = fit
+        self._sessions = OrderedDict()  # session_id -> (last_access, messages)
+        # Locks are only kept alive by the requests currently using them
+        self._locks = weakref.WeakValueDictionary()
+        self._mutex = threading.Lock()
+
+    def get(self, session_id):
+        """
+        Returns a copy of the session history, starting a new one if the session is unknown or expired.
+        """
+        now = time.time()
+        with self._mutex:
+            self._evict_expired(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return [self.system_message]
+            self._sessions[session_id] = (now, entry[1])
+            self._sessions.move_to_end(session_id)
+            return list(entry[1])
+
+    def _bound(self, messages):
+        if self.fit is not None:
+            return self.fit(list(messages))
+        return trim_messages(list(messages), self.max_messages)
+
+    def save(self, session_id, messages):
+        messages = self._bound(messages)
+        now = time.time()
+        with self._mutex:
+            self._sessions[session_id] = (now, messages)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._mutex:
+            self._sessions.pop(session_id, None)
+
+    def lock(self, session_id):
+        """
+        Returns the asyncio lock serializing turns within one session. Different sessions never share a lock.
+        """
+        with self._mutex:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = self._locks[session_id] = asyncio.Lock()
+            return lock
+
+    def __len__(self):
+        with self._mutex:
+            return len(self._sessions)
+
+    def _evict_expired(self, now):
+        # Entries are kept in access order, so expired sessions are always at the front
+        while self._sessions:
+            last_access, _ = next(iter(self._sessions.values()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            self._sessions.popitem(last=False)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Same interface as SessionStore, but histories are persisted in a SQLite database
+    so they survive restarts and can be shared by several server processes.
+    """
+
+    def __init__(self, path, system_message, max_sessions=10000, ttl_seconds=7 * 24 * 3600, max_messages=50, fit=None):
+        super().__init__(system_message, max_sessions, ttl_seconds, max_messages, fit)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+        self._conn.commit()
+
+    def get(self, session_id):
+        now = time.time()
+        with self._mutex:
+            row = self._conn.execute(
+                "SELECT messages, last_access FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                return [self.system_message]
+            self._conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+            self._conn.commit()
+        messages = json.loads(row[0])
+        # The system prompt is not persisted, it may change between deployments; a summary comes first if there is one
+        return [self.system_message] + messages
+
+    def save(self, session_id, messages):
+        messages = self._bound(messages)
+        # The conversation summary is history and is kept, only the prompt is left out
+        history = [message for message in messages if not _is_prompt(message)]
+        payload = json.dumps(history, default=_to_jsonable)
+        now = time.time()
+        with self._mutex:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, messages, last_access) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET messages = excluded.messages, last_access = excluded.last_access",
+                (session_id, payload, now),
+            )
+            self._conn.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM sessions WHERE session_id NOT IN "
+                "(SELECT session_id FROM sessions ORDER BY last_access DESC LIMIT ?)",
+                (self.max_sessions,),
+            )
+            self._conn.commit()
+
+    def delete(self, session_id):
+        with self._mutex:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._mutex:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def create_session_store(system_message, fit=None):
+    """
+    Builds the session store from environment variables.
+    FLOWCHAIN_SESSION_DB selects the SQLite backend, otherwise sessions are kept in memory.
+    fit bounds saved histories, FLOWCHAIN_SESSION_MAX_MESSAGES is only used without it.
+    """
+    ttl_seconds = int(os.environ.get("FLOWCHAIN_SESSION_TTL", 3600))
+    max_sessions = int(os.environ.get("FLOWCHAIN_MAX_SESSIONS", 1000))
+    max_messages = int(os.environ.get("FLOWCHAIN_SESSION_MAX_MESSAGES", 50))
+    db_path = os.environ.get("FLOWCHAIN_SESSION_DB")
+    if db_path:
+        return SQLiteSessionStore(db_path, system_message, max_sessions, ttl_seconds, max_messages, fit)
+    return SessionStore(system_message, max_sessions, ttl_seconds, max_messages, fit)
@@ -0,0 +1,162 @@
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds a read-only tool result stays valid. Tools not listed here are never cached.
+DEFAULT_TTLS = {
+    "get_phone_number": 600,
+    "get_email_address": 600,
+    "get_full_names_from_first_name": 600,
+    "get_events": 60,
+    "get_first_calendar": 3600,
+    "unread_count": 15,
+    "get_shortcuts": 300,
+}
+
+
+def _event_in_range(mutation_args, cached_args):
+    """
+    True if the event created/deleted by a mutating call falls in the date range of a cached get_events call.
+    """
+    try:
+        event_date = str(mutation_args["start_date"])[:10]
+        start = str(cached_args.get("start_date") or time.strftime("%Y-%m-%d"))[:10]
+        end = str(cached_args.get("end_date") or start)[:10]
+    except (KeyError, TypeError):
+        return True
+    return start <= event_date <= end
+
+
+# Mutating tool -> {cached tool: predicate(mutation_args, cached_args)}, a None predicate drops every entry of that tool
+DEFAULT_INVALIDATIONS = {
+    "create_apple_calendar_event": {"get_events": _event_in_range},
+    "create_apple_calendar_events": {"get_events": None},
+    "delete_event": {"get_events": _event_in_range},
+}
+
+NOT_FOUND_NAMES = ("No contacts found.", "This method is only supported on MacOS")
+
+# Cached tool -> predicate(response) telling a real result from an error or not-found message, which the
+# tools return as text too. Those are not cached, so the next call retries (and the contacts index refreshes)
+DEFAULT_RESULT_CHECKS = {
+    "get_phone_number": lambda response: isinstance(response, str) and re.match(r"\+?[\d(]", response) is not None,
+    "get_email_address": lambda response: isinstance(response, str) and re.fullmatch(r"[^\s@]+@[^\s@]+", response) is not None,
+    "get_full_names_from_first_name": lambda response: isinstance(response, str) and response not in NOT_FOUND_NAMES,
+    "get_events": lambda response: isinstance(response, list) or response == "No events found for the specified date.",
+    "get_first_calendar": lambda response: bool(response),
+    "unread_count": lambda response: isinstance(response, int) or response == "50 or more",
+    "get_shortcuts": lambda response: isinstance(response, list),
+}
+
+
+def normalize_arguments(arguments):
+    """
+    Canonical form of tool arguments: sorted keys, no None values, surrounding whitespace stripped.
+    """
+    normalized = {}
+    for key, value in (arguments or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        normalized[key] = value
+    return normalized
+
+
+class ToolCache:
+    """
+    LRU cache of read-only tool results keyed by tool name plus normalized arguments,
+    with a TTL per tool and invalidation when a mutating tool runs.
+    """
+
+    def __init__(self, ttls=None, invalidations=None, result_checks=None, max_entries=512):
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.invalidations = dict(DEFAULT_INVALIDATIONS, **(invalidations or {}))
+        self.result_checks = dict(DEFAULT_RESULT_CHECKS, **(result_checks or {}))
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (name, key) -> (expires_at, arguments, result)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def is_cacheable(self, function_name):
+        return function_name in self.ttls
+
+    def accepts(self, function_name, response):
+        """
+        Whether what a tool returned is a result worth caching, tools without a check cache anything.
+        """
+        if not self.is_cacheable(function_name):
+            return False
+        check = self.result_checks.get(function_name)
+        return check is None or check(response)
+
+    def _key(self, function_name, arguments):
+        return function_name, json.dumps(normalize_arguments(arguments), sort_keys=True, default=str)
+
+    def _count(self, function_name, field):
+        stats = self._stats.setdefault(function_name, {"hits": 0, "misses": 0, "invalidations": 0})
+        stats[field] += 1
+
+    def get(self, function_name, arguments):
+        """
+        Returns (True, result) on a hit and (False, None) on a miss.
+        """
+        if not self.is_cacheable(function_name):
+            return False, None
+        key = self._key(function_name, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._count(function_name, "hits")
+                return True, entry[2]
+            if entry is not None:
+                del self._entries[key]
+            self._count(function_name, "misses")
+            return False, None
+
+    def put(self, function_name, arguments, result):
+        if not self.is_cacheable(function_name):
+            return
+        key = self._key(function_name, arguments)
+        expires_at = time.monotonic() + self.ttls[function_name]
+        with self._lock:
+            self._entries[key] = (expires_at, normalize_arguments(arguments), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_for(self, function_name, arguments):
+        """
+        Drops the cached entries affected by running a mutating tool with the given arguments.
+        """
+        rules = self.invalidations.get(function_name)
+        if not rules:
+            return 0
+        arguments = normalize_arguments(arguments)
+        with self._lock:
+            stale = [
+                key for key, (_, cached_args, _) in self._entries.items()
+                if key[0] in rules and (rules[key[0]] is None or rules[key[0]](arguments, cached_args))
+            ]
+            for key in stale:
+                del self._entries[key]
+                self._count(key[0], "invalidations")
+        return len(stale)
+
+    def clear(self, function_name=None):
+        with self._lock:
+            for key in [key for key in self._entries if function_name is None or key[0] == function_name]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            per_tool = {name: dict(counts) for name, counts in self._stats.items()}
+            return {
+                "entries": len(self._entries),
+                "hits": sum(counts["hits"] for counts in per_tool.values()),
+                "misses": sum(counts["misses"] for counts in per_tool.values()),
+                "tools": per_tool,
+            }
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from tool_policy import accepted_message, tool_policy
+
+# Tools driving the same macOS app through AppleScript are limited so they don't pile up Apple events
+DEFAULT_CONCURRENCY = {
+    "get_events": 2,
+    "create_apple_calendar_event": 1,
+    "create_apple_calendar_events": 1,
+    "delete_event": 1,
+    "send_email": 1,
+    "send_sms": 1,
+    "generate_and_execute_applescript": 1,
+    "run_shortcut": 2,
+}
+
+# Seconds before a tool call is abandoned, anything not listed uses the executor default
+DEFAULT_TIMEOUTS = {
+    "get_email": 90,
+    "send_email": 120,
+    "create_apple_calendar_events": 120,
+    "create_google_calendar_events": 60,
+    "generate_and_execute_applescript": 120,
+}
+
+
+def format_tool_result(function_response):
+    """
+    Converts whatever a tool returned into the string content of a tool message.
+    """
+    # If the response is a json, convert it to a string
+    if isinstance(function_response, dict):
+        return json.dumps(function_response)
+
+    # if function response is a list, then combine them into a single string
+    if isinstance(function_response, list):
+        # if the response is a list of dictionaries, convert them to strings
+        return ",".join(
+            json.dumps(item) if isinstance(item, dict) else str(item) for item in function_response
+        )
+
+    # Tool message content has to be a string, e.g. unread_count returns an int
+    if not isinstance(function_response, str):
+        return str(function_response)
+    return function_response
+
+
+class ToolExecutor:
+    """
+    Runs tool calls on a bounded thread pool. Independent calls from the same model turn
+    run at the same time, each tool has its own concurrency limit and timeout.
+    """
+
+    def __init__(self, functions, max_workers=None, default_timeout=60, concurrency=None, timeouts=None, cache=None, jobs=None):
+        self.functions = functions
+        self.cache = cache
+        # Background tools are handed to this job queue, they run inline when there is none
+        self.jobs = jobs
+        self.max_workers = max_workers or int(os.environ.get("FLOWCHAIN_TOOL_WORKERS", 8))
+        self.default_timeout = default_timeout
+        self.concurrency = dict(DEFAULT_CONCURRENCY, **(concurrency or {}))
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool")
+        self._semaphores = {}
+        # Calls that timed out but are still running on a pool thread
+        self._abandoned = set()
+        self._abandoned_lock = threading.Lock()
+
+    def _semaphore(self, function_name):
+        limit = self.concurrency.get(function_name)
+        if limit is None:
+            return None
+        if function_name not in self._semaphores:
+            self._semaphores[function_name] = asyncio.Semaphore(limit)
+        return self._semaphores[function_name]
+
+    async def run(self, function_name, arguments):
+        """
+        Runs one tool call and returns its result as a string for the tool message.
+        Errors and timeouts are returned as text so the model can see what went wrong.
+        """
+        function_to_call = self.functions.get(function_name)
+        if function_to_call is None:
+            return f"Unknown tool: {function_name}"
+
+        timeout = self.timeouts.get(function_name, self.default_timeout)
+        try:
+            function_args = json.loads(arguments) if isinstance(arguments, str) else (arguments or {})
+            policy = tool_policy(function_to_call)
+            if self.jobs is not None and policy.get("background"):
+                job = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, lambda: self.jobs.submit(function_name, function_args, policy.get("attempts"))
+                )
+                return accepted_message(job)
+            if self.cache is not None:
+                hit, cached = self.cache.get(function_name, function_args)
+                if hit:
+                    return cached
+            function_response = await self._call(function_name, function_to_call, function_args, timeout)
+        except asyncio.TimeoutError:
+            # The worker thread can't be interrupted, it finishes in the background and its result is dropped
+            function_response = f"{function_name} timed out after {timeout} seconds"
+            print(f"{function_response}, {self.abandoned()} abandoned tool calls still running")
+            return function_response
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return str(e)
+
+        result = format_tool_result(function_response)
+        # Only real results are cached, errors, not-found messages and timeouts are retried next time
+        if self.cache is not None:
+            if self.cache.accepts(function_name, function_response):
+                self.cache.put(function_name, function_args, result)
+            self.cache.invalidate_for(function_name, function_args)
+        return result
+
+    async def _call(self, function_name, function_to_call, function_args, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        semaphore = self._semaphore(function_name)
+        if semaphore is not None:
+            await asyncio.wait_for(semaphore.acquire(), timeout)
+        try:
+            future = self._pool.submit(lambda: function_to_call(**function_args))
+        except BaseException:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+
+        def finished(done):
+            with self._abandoned_lock:
+                self._abandoned.discard(done)
+            # The slot is given back when the call really ends, not when the caller stops waiting,
+            # so a hung call still counts against its tool's limit
+            if semaphore is not None:
+                try:
+                    loop.call_soon_threadsafe(semaphore.release)
+                except RuntimeError:
+                    pass  # event loop already closed
+
+        future.add_done_callback(finished)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), max(0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            with self._abandoned_lock:
+                if not future.done():
+                    self._abandoned.add(future)
+            raise
+
+    def abandoned(self):
+        """
+        Number of timed out calls still occupying a pool thread.
+        """
+        with self._abandoned_lock:
+            return len(self._abandoned)
+
+    async def run_all(self, calls):
+        """
+        Runs (function_name, arguments) pairs concurrently, results come back in the order of calls.
+        """
+        return await asyncio.gather(*(self.run(name, arguments) for name, arguments in calls))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
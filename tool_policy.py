@@ -0,0 +1,111 @@
+import json
+import re
+import threading
+from collections import Counter
+
+# How the reply to a round of tool calls is produced, set per tool with @tool(policy=...) (tools/registry.py)
+#   "model"     the results go back to the model for another completion (default)
+#   "final"     the tool result is shown to the user as is
+#   "template"  the reply is formatted locally from the tool's template, e.g. 'Sent "{message}" to {to}.'
+# Local replies are only used when the result matches the tool's success pattern, anything else
+# (errors, unexpected output) still goes to the model so it can explain or recover.
+#
+# Background tools (@tool(background=True)) are queued as jobs by the executor, the acceptance
+# message is the reply whatever their policy, so the chat request returns right away.
+ACCEPTED_PATTERN = r"Started \w+ in the background \(job \w+\)"
+
+
+def accepted_message(job):
+    return f"Started {job['tool']} in the background (job {job['id']}). get_job_status tells when it is done."
+
+
+def tool_policy(function):
+    """
+    Policy of a dispatch table entry, LazyTool entries carry it from the registry artifact.
+    """
+    policy = getattr(function, "policy", None)
+    if policy is None:
+        policy = getattr(function, "__tool__", {})
+    return policy
+
+
+def _arguments(arguments):
+    if isinstance(arguments, str):
+        try:
+            return json.loads(arguments or "{}")
+        except ValueError:
+            return None
+    return arguments or {}
+
+
+def local_text(policy, arguments, result):
+    """
+    Text of a local reply for one tool call, or None if this call needs the model.
+    """
+    result = result if isinstance(result, str) else str(result)
+    if policy.get("background") and re.match(ACCEPTED_PATTERN, result):
+        return result
+    kind = policy.get("policy") or "model"
+    if kind == "model":
+        return None
+    success = policy.get("success")
+    if success and not re.match(success, result):
+        return None
+    if kind == "final":
+        return result
+    arguments = _arguments(arguments)
+    if arguments is None:
+        return None
+    try:
+        return policy["template"].format_map(dict(arguments, result=result))
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def local_reply(calls, results, functions):
+    """
+    Reply to a round of (function_name, arguments) calls built without another completion,
+    in the JSON format of the system prompt. None when any of the calls needs the model.
+    """
+    texts = []
+    for (function_name, arguments), result in zip(calls, results):
+        function = functions.get(function_name)
+        if function is None:
+            return None
+        text = local_text(tool_policy(function), arguments, result)
+        if text is None:
+            return None
+        texts.append(text)
+    if not texts:
+        return None
+    return json.dumps({"Response": " ".join(texts), "Actions": []})
+
+
+class TurnStats:
+    """
+    Counts model round trips per user turn, and how many turns were answered with a local reply.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.round_trips = 0
+        self.local_replies = 0
+        self.histogram = Counter()
+
+    def record(self, round_trips, local=False):
+        with self._lock:
+            self.turns += 1
+            self.round_trips += round_trips
+            self.local_replies += local
+            self.histogram[round_trips] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "round_trips": self.round_trips,
+                "average_round_trips": round(self.round_trips / self.turns, 2) if self.turns else 0,
+                "local_replies": self.local_replies,
+                "histogram": dict(sorted(self.histogram.items())),
+            }
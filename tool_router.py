@@ -0,0 +1,167 @@
+import math
+import re
+from collections import Counter
+
+# Internal helpers that are never useful for the model to call, in case they get registered as tools
+EXCLUDED_TOOLS = ("calculate_upload_delay", "format_path_for_applescript")
+
+# Fallbacks that are sent every turn, so the model can always do something
+ALWAYS_INCLUDED = ("get_shortcuts", "run_shortcut", "generate_and_execute_applescript")
+
+# Tools that are usually needed together, e.g. a name has to be resolved before texting someone
+COMPANIONS = {
+    "send_sms": ["get_phone_number", "get_full_names_from_first_name"],
+    "send_email": ["get_email_address", "get_full_names_from_first_name", "get_email_status"],
+    "get_email": ["get_email_content"],
+    "create_apple_calendar_event": ["get_events"],
+    "create_apple_calendar_events": ["get_events"],
+    "delete_event": ["get_events"],
+    "get_job_status": ["cancel_job"],
+}
+
+# Words users say that don't appear in the tool descriptions
+SYNONYMS = {
+    "sms": ["text", "texts", "message", "imessage", "messages"],
+    "email": ["mail", "emails", "inbox", "reply", "gmail"],
+    "calendar": ["meeting", "meetings", "event", "events", "schedule", "appointment", "busy", "free", "agenda"],
+    "contact": ["phone", "number", "call", "person", "who"],
+    "search": ["google", "look", "find", "news", "latest"],
+    "location": ["map", "maps", "directions", "where", "address", "restaurant"],
+    "paraphrase": ["rewrite", "rephrase", "reword"],
+    "weather": ["temperature", "forecast", "rain"],
+    "shortcut": ["shortcuts", "automation", "timer", "pomodoro"],
+    "command": ["terminal", "shell", "run"],
+    "job": ["done", "finished", "status", "progress", "cancel", "stop", "background"],
+}
+
+STOP_WORDS = {
+    "the", "a", "an", "to", "of", "and", "or", "for", "in", "on", "is", "it", "me", "my", "i",
+    "you", "with", "by", "be", "this", "that", "given", "using", "can", "please", "what", "from",
+}
+
+
+def tokenize(text):
+    tokens = []
+    for word in re.findall(r"[a-z0-9]+", text.lower().replace("_", " ")):
+        if word in STOP_WORDS or len(word) < 2:
+            continue
+        # Crude stemming, enough to match "emails" with "email" and "scheduled" with "schedule"
+        for suffix in ("ing", "ed", "es", "s"):
+            if len(word) > len(suffix) + 2 and word.endswith(suffix):
+                word = word[: -len(suffix)]
+                break
+        tokens.append(word)
+    return tokens
+
+
+def tool_document(tool):
+    function = tool["function"]
+    parts = [function["name"], function.get("description", "")]
+    for name, schema in function.get("parameters", {}).get("properties", {}).items():
+        parts.extend([name, schema.get("description", "")])
+    tokens = tokenize(" ".join(parts))
+    # Expand the document with user vocabulary for the concepts it mentions
+    for concept, words in SYNONYMS.items():
+        if tokenize(concept)[0] in tokens:
+            tokens.extend(tokenize(" ".join(words)))
+    return tokens
+
+
+class ToolRouter:
+    """
+    Picks the tool schemas relevant to the current turn with a BM25 index over tool names,
+    descriptions and parameter descriptions, instead of sending every schema with every request.
+    """
+
+    def __init__(self, tools, top_k=6, min_score_ratio=0.3, always=ALWAYS_INCLUDED, exclude=EXCLUDED_TOOLS, k1=1.2, b=0.75):
+        self.tools = {tool["function"]["name"]: tool for tool in tools if tool["function"]["name"] not in exclude}
+        self.top_k = top_k
+        self.min_score_ratio = min_score_ratio
+        self.always = [name for name in always if name in self.tools]
+        self.k1 = k1
+        self.b = b
+        self._documents = {name: Counter(tool_document(tool)) for name, tool in self.tools.items()}
+        self._lengths = {name: sum(counts.values()) for name, counts in self._documents.items()}
+        self._average_length = sum(self._lengths.values()) / max(1, len(self._lengths))
+        frequencies = Counter(term for counts in self._documents.values() for term in counts)
+        total = len(self._documents)
+        self._idf = {
+            term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in frequencies.items()
+        }
+        self._payloads = {}
+
+    def score(self, query):
+        terms = tokenize(query)
+        scores = {}
+        for name, counts in self._documents.items():
+            score = 0.0
+            for term in terms:
+                frequency = counts.get(term)
+                if not frequency:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[name] / self._average_length)
+                score += self._idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            if score > 0:
+                scores[name] = score
+        return scores
+
+    def select_names(self, query, recent_tools=()):
+        scores = self.score(query)
+        ranked = sorted(scores, key=scores.get, reverse=True)[: self.top_k]
+        # Weak matches on incidental words are noise, keep tools scoring close to the best one
+        ranked = [name for name in ranked if scores[name] >= scores[ranked[0]] * self.min_score_ratio]
+        names = set(ranked) | set(self.always)
+        for name in ranked:
+            names.update(companion for companion in COMPANIONS.get(name, []) if companion in self.tools)
+        # Tools used earlier in the conversation stay available for follow-up requests
+        names.update(name for name in recent_tools if name in self.tools)
+        return tuple(sorted(names))
+
+    def select(self, messages):
+        """
+        Returns the tool schemas for the next completion, based on the latest user messages
+        and the tools called recently.
+        """
+        names = self.select_names(recent_user_text(messages), recent_tool_names(messages))
+        return self.payload(names)
+
+    def payload(self, names):
+        """
+        Returns the tools list for a set of tool names, built once per distinct set. The client
+        serializes the request body itself, so the cache holds the schema list, not its JSON.
+        """
+        payload = self._payloads.get(names)
+        if payload is None:
+            if len(self._payloads) >= 256:
+                self._payloads.clear()
+            payload = self._payloads[names] = [self.tools[name] for name in names]
+        return payload
+
+
+def _get(message, key):
+    if isinstance(message, dict):
+        return message.get(key)
+    return getattr(message, key, None)
+
+
+def recent_user_text(messages, turns=2):
+    texts = []
+    for message in reversed(messages):
+        if _get(message, "role") != "user":
+            continue
+        content = _get(message, "content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+        texts.append(content or "")
+        if len(texts) >= turns:
+            break
+    return " ".join(reversed(texts))
+
+
+def recent_tool_names(messages, limit=10):
+    names = []
+    for message in reversed(messages[-limit:]):
+        if _get(message, "role") == "tool" and _get(message, "name"):
+            names.append(_get(message, "name"))
+    return names
@@ -3,14 +3,39 @@ import platform
 import subprocess
 
 from app_utils import run_applescript, run_applescript_capture
+from tools.calendar_store import create_script, get_store, make_event, parse_created
+from tools.google_auth import has_credentials
+from tools.registry import tool
+from tools.scheduler import parse_preferences, suggest_slots
 
 app_name = "Calendar"
 
+# Schema of one event in create_apple_calendar_events
+EVENT_ITEM = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string", "description": "The title of the event"},
+        "start_date": {"type": "string", "description": "Start date and time in the format '%Y-%m-%dT%H:%M:%S'"},
+        "end_date": {"type": "string", "description": "End date and time in the format '%Y-%m-%dT%H:%M:%S'"},
+        "location": {"type": "string", "description": "The location of the event"},
+        "notes": {"type": "string", "description": "Any additional notes for the event"},
+    },
+    "required": ["title", "start_date", "end_date"],
+}
+
 class Calendar:
     @staticmethod
+    @tool(required=["start_date"])
     def get_events(start_date=None, end_date=None):
         """
         Fetches calendar events for the given date or date range.
+
+        Args:
+        start_date (str): Start date in the format 'YYYY-MM-DD'
+        end_date (str): End date in the format 'YYYY-MM-DD'
+
+        Returns:
+        list: Event records with title, start, end, calendar, location, notes and attendees.
         """
         if platform.system() != "Darwin":
             return "This method is only supported on MacOS"
@@ -28,152 +53,40 @@ class Calendar:
         else:
             end_date = None
 
-        # Format dates for AppleScript
-        applescript_start_date = (
-            start_date.strftime("%A, %B %d, %Y") + " at 12:00:00 AM"
-        )
-        if end_date:
-            applescript_end_date = (
-                end_date.strftime("%A, %B %d, %Y") + " at 11:59:59 PM"
-            )
-        else:
-            applescript_end_date = (
-                start_date.strftime("%A, %B %d, %Y") + " at 11:59:59 PM"
-            )
-
-        # AppleScript command
-        script = f"""
-        set theDate to date "{applescript_start_date}"
-        set endDate to date "{applescript_end_date}"
-        tell application "System Events"
-            set calendarIsRunning to (name of processes) contains "{app_name}"
-            if calendarIsRunning then
-                tell application "{app_name}" to activate
-            else
-                tell application "{app_name}" to launch
-                delay 1 -- Wait for the application to open
-                tell application "{app_name}" to activate
-            end if
-        end tell
-
-        set outputText to ""
-
-        -- Access the Calendar app
-        tell application "{app_name}"
-            
-            -- Initialize a list to hold summaries and dates of all events from all calendars
-            set allEventsInfo to {{}}
-            
-            -- Loop through each calendar
-            repeat with aCalendar in calendars
-                
-                -- Fetch events from this calendar that fall within the specified date range
-                set theseEvents to (every event of aCalendar where its start date is greater than theDate and its start date is less than endDate)
-                
-                -- Loop through theseEvents to extract necessary details
-                repeat with anEvent in theseEvents
-                    -- Initialize variables to "None" to handle missing information gracefully
-                    set attendeesString to "None"
-                    set theNotes to "None"
-                    set theLocation to "None"
-                    
-                    -- Try to get attendees, but fail gracefully
-                    try
-                        set attendeeNames to {{}}
-                        repeat with anAttendee in attendees of anEvent
-                            set end of attendeeNames to name of anAttendee
-                        end repeat
-                        if (count of attendeeNames) > 0 then
-                            set attendeesString to my listToString(attendeeNames, ", ")
-                        end if
-                    on error
-                        set attendeesString to "None"
-                    end try
-                    
-                    -- Try to get notes, but fail gracefully
-                    try
-                        set theNotes to notes of anEvent
-                        if theNotes is missing value then set theNotes to "None"
-                    on error
-                        set theNotes to "None"
-                    end try
-                    
-                    -- Try to get location, but fail gracefully
-                    try
-                        set theLocation to location of anEvent
-                        if theLocation is missing value then set theLocation to "None"
-                    on error
-                        set theLocation to "None"
-                    end try
-                    
-                    -- Create a record with the detailed information of the event
-                    set eventInfo to {{|summary|:summary of anEvent, |startDate|:start date of anEvent, |endDate|:end date of anEvent, |attendees|:attendeesString, notes:theNotes, |location|:theLocation}}
-                    -- Append this record to the allEventsInfo list
-                    set end of allEventsInfo to eventInfo
-                end repeat
-            end repeat
-        end tell
-
-        -- Check if any events were found and build the output text
-        if (count of allEventsInfo) > 0 then
-            repeat with anEventInfo in allEventsInfo
-                -- Always include Event, Start Date, and End Date
-                set eventOutput to "Event: " & (summary of anEventInfo) & " | Start Date: " & (|startDate| of anEventInfo) & " | End Date: " & (|endDate| of anEventInfo)
-                
-                -- Conditionally include other details if they are not "None"
-                if (attendees of anEventInfo) is not "None" then
-                    set eventOutput to eventOutput & " | Attendees: " & (attendees of anEventInfo)
-                end if
-                if (notes of anEventInfo) is not "None" then
-                    set eventOutput to eventOutput & " | Notes: " & (notes of anEventInfo)
-                end if
-                if (location of anEventInfo) is not "None" then
-                    set eventOutput to eventOutput & " | Location: " & (location of anEventInfo)
-                end if
-                
-                -- Add the event's output to the overall outputText, followed by a newline for separation
-                set outputText to outputText & eventOutput & "
-        "
-            end repeat
-        else
-            set outputText to "No events found for the specified date."
-        end if
-
-        -- Return the output text
-        return outputText
-
-        -- Helper subroutine to convert a list to a string
-        on listToString(theList, delimiter)
-            set AppleScript's text item delimiters to delimiter
-            set theString to theList as string
-            set AppleScript's text item delimiters to ""
-            return theString
-        end listToString
-
-        """
-
-        # Get outputs from AppleScript
-        stdout, stderr = run_applescript_capture(script)
-        if stderr:
+        # Answered from the local event store, Calendar.app is only queried for days not synced yet
+        try:
+            events = get_store().query(start_date, end_date or start_date)
+        except RuntimeError as e:
             # If the error is due to not having access to the calendar app, return a helpful message
-            if "Not authorized to send Apple events to Calendar" in stderr:
+            if "Not authorized to send Apple events to Calendar" in str(e):
                 return "Calendar access not authorized. Please allow access in System Preferences > Security & Privacy > Automation."
             else:
-                return stderr
+                return str(e)
 
-        return stdout
+        if not events:
+            return "No events found for the specified date."
+        return events
 
     @staticmethod
+    @tool(policy="final", success="Event created successfully")
     def create_apple_calendar_event(
         title: str,
-        start_date: datetime.datetime,
-        end_date: datetime.datetime,
+        start_date: str,
+        end_date: str,
         location: str = "",
         notes: str = "",
         calendar: str = None,
     ) -> str:
         """
-        Creates a new calendar event in the default calendar with the given parameters using AppleScript.
+        Creates a new Apple calendar event in the default calendar with the given parameters using AppleScript.
+
+        Args:
+        title (str): The title of the event
+        start_date (str): The start date and time of the event in the format '%Y-%m-%dT%H:%M:%S'
+        end_date (str): The end date and time of the event in the format '%Y-%m-%dT%H:%M:%S'
+        location (str): The location of the event
+        notes (str): Any additional notes for the event
+        calendar (str): The calendar in which the event will be created. If not specified, the first calendar available will be used.
         """
         if platform.system() != "Darwin":
             return "This method is only supported on MacOS"
@@ -206,24 +119,88 @@ class Calendar:
             tell calendar "{calendar}"
                 set startDate to date "{applescript_start_date}"
                 set endDate to date "{applescript_end_date}"
-                make new event at end with properties {{summary:"{title}", start date:startDate, end date:endDate, location:"{location}", description:"{notes}"}}
+                set newEvent to make new event at end with properties {{summary:"{title}", start date:startDate, end date:endDate, location:"{location}", description:"{notes}"}}
             end tell
             -- tell the Calendar app to refresh if it's running, so the new event shows up immediately
             tell application "{app_name}" to reload calendars
+            return uid of newEvent
         end tell
         """
 
         try:
-            run_applescript(script)
-            return f"""Event created successfully in the "{calendar}" calendar."""
+            uid = run_applescript(script).strip()
         except subprocess.CalledProcessError as e:
             return str(e)
+        # Write-through, so the next get_events sees the event without a round trip to Calendar.app
+        get_store().added(make_event(uid, calendar, title, start_date, end_date, location, notes))
+        return f"""Event created successfully in the "{calendar}" calendar."""
         
 
     @staticmethod
+    @tool(items={"events": EVENT_ITEM}, policy="final", success=r"Created (\d+) of \1 events")
+    def create_apple_calendar_events(events: list, calendar: str = None) -> str:
+        """
+        Creates several Apple calendar events at once, e.g. a series of meetings. Use this instead of calling create_apple_calendar_event repeatedly.
+
+        Args:
+        events (list): The events to create, each with title, start_date, end_date and optionally location and notes
+        calendar (str): The calendar in which the events will be created. If not specified, the first calendar available will be used.
+        """
+        if platform.system() != "Darwin":
+            return "This method is only supported on MacOS"
+
+        # Invalid items are reported and skipped, the rest are created with one script
+        errors = {}
+        valid = []
+        for index, event in enumerate(events):
+            try:
+                valid.append((index, dict(
+                    event,
+                    title=event["title"],
+                    start=datetime.datetime.strptime(event["start_date"], '%Y-%m-%dT%H:%M:%S'),
+                    end=datetime.datetime.strptime(event["end_date"], '%Y-%m-%dT%H:%M:%S'),
+                )))
+            except (KeyError, TypeError, ValueError) as e:
+                errors[index] = f"invalid event: {e}"
+
+        if calendar is None:
+            calendar = Calendar.get_first_calendar()
+            if calendar is None:
+                return "Can't find a default calendar. Please try again and specify a calendar name."
+
+        created = 0
+        if valid:
+            stdout, stderr = run_applescript_capture(create_script(calendar, [event for _, event in valid]))
+            results = parse_created(stdout) if not stderr else []
+            for position, (index, event) in enumerate(valid):
+                uid, error = results[position] if position < len(results) else (None, stderr.strip() or "no result")
+                if uid is None:
+                    errors[index] = error
+                    continue
+                created += 1
+                get_store().added(make_event(
+                    uid, calendar, event["title"], event["start"], event["end"], event.get("location"), event.get("notes")
+                ))
+
+        report = f"""Created {created} of {len(events)} events in the "{calendar}" calendar."""
+        for index in sorted(errors):
+            title = events[index].get("title") if isinstance(events[index], dict) else None
+            report += f"\nEvent {index + 1} ({title or 'untitled'}) failed: {errors[index]}"
+        return report
+
+    @staticmethod
+    @tool(policy="final", success="Event deleted successfully")
     def delete_event(
-        event_title: str, start_date: datetime.datetime, calendar: str = None
+        event_title: str, start_date: str, calendar: str = None
     ) -> str:
+        """
+        This method is used to delete an event from the calendar.
+
+        Args:
+        event_title (str): The title of the event to be deleted
+        start_date (str): The start date of the event to be deleted in the format '%Y-%m-%dT%H:%M:%S'
+        calendar (str): The calendar name where the event is located. If not specified, the default calendar will be used.
+        """
         if platform.system() != "Darwin":
             return "This method is only supported on MacOS"
 
@@ -277,20 +254,50 @@ class Calendar:
         end tell
         """
 
-        stderr, stdout = run_applescript_capture(script)
-        if stdout:
-            return stdout[0].strip()
-        elif stderr:
-            if "successfully" in stderr:
-                return stderr
-
+        stdout, stderr = run_applescript_capture(script)
+        if stderr:
             return f"""Error deleting event: {stderr}"""
+        elif "successfully" in stdout:
+            get_store().deleted(event_title, start_date, calendar)
+            return stdout.strip()
+        elif stdout:
+            return stdout.strip()
         else:
             return "Unknown error deleting event. Please check event title and date."
 
     @staticmethod
+    @tool(required=["duration_minutes"])
+    def find_free_time(duration_minutes: int = 60, preferences: str = None, attendees: str = None):
+        """
+        Suggests free time slots for a meeting between 9am and 9pm, checking the Apple and Google calendars (and the attendees' Google calendars when shared).
+
+        Args:
+        duration_minutes (int): Length of the meeting in minutes
+        preferences (str): Time preferences in the user's words, e.g. 'next week, preferably a morning'
+        attendees (str): Attendee emails separated by commas
+
+        Returns:
+        list: Up to 5 free slots with start and end, best first.
+        """
+        emails = [email.strip() for email in (attendees or "").split(",") if email.strip()]
+        slots = suggest_slots(
+            parse_preferences(preferences),
+            duration_minutes=duration_minutes,
+            attendees=emails,
+            # Only calendars that are already connected, a tool call mustn't open the Google sign-in page
+            google=has_credentials(),
+            apple=platform.system() == "Darwin",
+        )
+        if not slots:
+            return "No free time found for the requested preferences."
+        return slots
+
+    @staticmethod
+    @tool()
     def get_first_calendar() -> str:
-        # Literally just gets the first calendar name of all the calendars on the system. AppleScript does not provide a way to get the "default" calendar
+        """
+        Literally just gets the first calendar name of all the calendars on the system. AppleScript does not provide a way to get the 'default' calendar
+        """
         script = f"""
             -- Open calendar first
             tell application "System Events"
@@ -1,57 +1,39 @@
-import openai
 import os
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 import datetime
-from dateutil.parser import parse
-from openai import OpenAI
 import json
-import pytesseract
-from PIL import Image
 import re
+from clients import get_openai
+from ocr import get_ocr
+from tools.google_auth import get_calendar_service, get_credentials
+from tools.registry import tool
+from tools.scheduler import parse_preferences, suggest_slots
 
-client = OpenAI()
+# The Google API client (through tools/google_auth.py), dateutil and PIL are imported by the functions that use them,
+# so registering this module's tools doesn't load them
 
-def authenticate_google_calendar():
-    scopes = ['https://www.googleapis.com/auth/calendar']
-    flow = InstalledAppFlow.from_client_secrets_file('client_secret.json', scopes=scopes)
-    credentials = flow.run_local_server(port=0)
-    return credentials
 
-def get_calendar_events(credentials, max_results=10):
-    try:
-        service = build('calendar', 'v3', credentials=credentials)
-        print (service)
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return []
-    
-    now = datetime.datetime.utcnow().isoformat() + 'Z'
-    # events_result = service.events().list(calendarId='primary', timeMin=now,
-    #                                       maxResults=max_results, singleEvents=True,
-    #                                       orderBy='startTime').execute()
-
-    # catch service events error
-    try:
-        events_result = service.events().list(calendarId='primary', timeMin=now,
-                                              maxResults=max_results, singleEvents=True,
-                                              orderBy='startTime').execute()
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return []
-    
-    events = events_result.get('items', [])
-    return events
+def authenticate_google_calendar():
+    # Saved token, refreshed when expired; the browser flow only runs the first time (see tools/google_auth.py)
+    return get_credentials()
 
 def create_calendar_event(credentials, summary, location, description, start_time, end_time, attendees):
     try:
-        service = build('calendar', 'v3', credentials=credentials)
-        print (service)
+        service = get_calendar_service()
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
 
-    event = {
+    event = event_body(summary, location, description, start_time, end_time, attendees)
+
+    event = service.events().insert(calendarId='primary', body=event).execute()
+    print('Event created: %s' % (event.get('htmlLink')))
+    return event
+
+# Google accepts up to 50 calls in one batch request for the Calendar API
+BATCH_SIZE = 50
+
+def event_body(summary, location, description, start_time, end_time, attendees):
+    return {
         'summary': summary,
         'location': location,
         'description': description,
@@ -65,10 +47,31 @@ def create_calendar_event(credentials, summary, location, description, start_tim
         },
         'attendees': [{'email': email} for email in attendees]
     }
-    
-    event = service.events().insert(calendarId='primary', body=event).execute()
-    print('Event created: %s' % (event.get('htmlLink')))
-    return event
+
+def create_calendar_events(bodies):
+    """
+    Inserts several events with Google's batch endpoint, one HTTP request per BATCH_SIZE events.
+    Returns one (event, None) or (None, error) per body, in order.
+    """
+    service = get_calendar_service()
+    results = [(None, "not sent")] * len(bodies)
+
+    def callback(request_id, response, exception):
+        index = int(request_id)
+        results[index] = (None, str(exception)) if exception is not None else (response, None)
+
+    for offset in range(0, len(bodies), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=callback)
+        for index in range(offset, min(offset + BATCH_SIZE, len(bodies))):
+            batch.add(service.events().insert(calendarId='primary', body=bodies[index]), request_id=str(index))
+        try:
+            batch.execute()
+        except Exception as e:
+            # The whole request failed, e.g. offline: every event of this batch gets the error
+            print(f"An error occurred: {e}")
+            for index in range(offset, min(offset + BATCH_SIZE, len(bodies))):
+                results[index] = (None, str(e))
+    return results
 
 def is_valid_email(email):
     # Simple regex for validating an email address, for a more complex validation consider using a library
@@ -119,8 +122,11 @@ def validate_event_details(details):
 
 
 def extract_text_from_image(image_path):
+    from PIL import Image
     try:
-        return pytesseract.image_to_string(Image.open(image_path))
+        # Preprocessed, cropped to the text and cached by content, see ocr.py
+        with Image.open(image_path) as image:
+            return get_ocr().text(image)
     except Exception as e:
         print(f"An error occurred: {e}")
         return None
@@ -132,7 +138,7 @@ def extract_event_details(user_input):
     Sample JSON format to return if multiple attendees present: {'summary': 'Meeting with John and Alice', 'location': 'Coffee Shop', 'description': 'Discuss project details', 'attendees': 'john@example.com,alice@example.com', 'time_preferences': 'Next Tuesday at 3PM'\n
     Sample JSON format to return if single attendee present: {'summary': 'Meeting with John and Alice', 'location': 'Coffee Shop', 'description': 'Discuss project details', 'attendees': 'john@example.com', 'time_preferences': 'Next Tuesday at 3PM'
     '''
-    response = client.chat.completions.create(
+    response = get_openai().chat.completions.create(
         model="gpt-4-turbo",
         messages=[
             {"role": "system", "content": message},
@@ -143,31 +149,16 @@ def extract_event_details(user_input):
     details_json = response.choices[0].message.content
     return details_json
 
-def suggest_optimal_time(credentials, user_constraints):
-    events = get_calendar_events(credentials)
-    event_data = "Here are the scheduled events:\n"
-    print ("All events:", events)
-    for event in events:
-        start = event['start'].get('dateTime', event['start'].get('date'))
-        end = event['end'].get('dateTime', event['end'].get('date'))
-        event_data += f"Event: {event['summary']} from {start} to {end}\n"
-
-    current_datetime = datetime.datetime.utcnow().isoformat() + 'Z'
-
-    prompt = f"As of today:{current_datetime},\n {event_data}\n with time preference: {user_constraints}"
-
-    response = client.chat.completions.create(
-      model="gpt-4-turbo",
-      messages=[
-          {"role": "system", "content": f"You are an AI event scheduler assistant and today's date is {current_datetime}. Your goal is to suggest the best time for the meeting based on any mentioned time preferences and the existing events on their calendar. Avoid any time before 9am and after 9pm. Only return the best date and time in RFC3339 date format. For example, just return '2022-01-01T12:00:00Z' and nothing else in your response."},
-          {"role": "user", "content": prompt}
-      ],
-      temperature=0
-    )
-    
-    suggested_time = response.choices[0].message.content
-    print("Suggested Optimal Time:", suggested_time)
-    return suggested_time
+def suggest_optimal_time(user_constraints, attendees=()):
+    # The model only turns the fuzzy preference into constraints, the slot itself comes from
+    # the free/busy solver over the Google and Apple calendars
+    preferences = parse_preferences(user_constraints)
+    slots = suggest_slots(preferences, attendees=attendees, count=1)
+    if not slots:
+        print("No free slot found for:", user_constraints)
+        return None
+    print("Suggested Optimal Time:", slots[0])
+    return slots[0]
 
 def suggest_and_schedule_event(credentials, details_json):
     details = json.loads(details_json)  # Convert JSON string back to dictionary
@@ -197,15 +188,19 @@ def suggest_and_schedule_event(credentials, details_json):
     user_constraints = details.get("time_preferences")
     print("Details:", details)
     
-    suggested_time = suggest_optimal_time(credentials, user_constraints)
-    print ("The suggested time is:", suggested_time)
-    if suggested_time:
-        return parse_and_schedule_event(credentials, suggested_time, summary, location, description, attendees)
+    suggested_slot = suggest_optimal_time(user_constraints, attendees)
+    print ("The suggested time is:", suggested_slot)
+    if suggested_slot:
+        return parse_and_schedule_event(credentials, suggested_slot["start"], summary, location, description, attendees, suggested_slot["end"])
 
 
-def parse_and_schedule_event(credentials, suggested_time, summary, location, description, attendees):
+def parse_and_schedule_event(credentials, suggested_time, summary, location, description, attendees, suggested_end=None):
+    from dateutil.parser import parse
     start_time = parse(suggested_time)
-    end_time = start_time + datetime.timedelta(hours=1)  # assuming the meeting lasts one hour
+    if suggested_end:
+        end_time = parse(suggested_end)
+    else:
+        end_time = start_time + datetime.timedelta(hours=1)  # assuming the meeting lasts one hour
 
     # Format times to RFC3339
     start_time = start_time.isoformat()
@@ -232,9 +227,77 @@ if __name__ == '__main__':
     #schedule_event_from_description()
     extract_details_from_image_and_schedule('sample_image_2.png')
 
+# Not a @tool: scheduling asks for missing details with input() and may open the Google sign-in in a
+# browser, which only works from a terminal
 def create_google_calendar_event (snapshot_details):
+    """
+    Creates a Google Calendar event from a description of the meeting, picking the best time based on the existing events.
+
+    Args:
+    snapshot_details (str): Description of the event including name, location, description, attendee emails and time preferences
+    """
     print('snapshot_details:', snapshot_details)
     credentials = authenticate_google_calendar()
     #user_input = input("Please describe the event you want to schedule, including the name, location, description, attendees, and any time preferences: ")
     event_details = extract_event_details(snapshot_details)
     return suggest_and_schedule_event(credentials, event_details)
+
+
+GOOGLE_EVENT_ITEM = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string", "description": "The title of the event"},
+        "start_time": {"type": "string", "description": "Start date and time in RFC3339 format, e.g. '2024-05-01T15:00:00-07:00'"},
+        "end_time": {"type": "string", "description": "End date and time in RFC3339 format"},
+        "location": {"type": "string", "description": "The location of the event"},
+        "description": {"type": "string", "description": "Description of the event"},
+        "attendees": {"type": "string", "description": "Attendee emails separated by commas"},
+    },
+    "required": ["summary", "start_time", "end_time"],
+}
+
+@tool(items={"events": GOOGLE_EVENT_ITEM}, policy="final", success=r"Created (\d+) of \1 Google Calendar events")
+def create_google_calendar_events(events: list):
+    """
+    Creates several Google Calendar events at fixed times with one batch request, e.g. a series of meetings.
+
+    Args:
+    events (list): The events to create, each with summary, start_time, end_time and optionally location, description and attendees
+    """
+    from dateutil.parser import parse
+    errors = {}
+    bodies = []
+    positions = []
+    for index, event in enumerate(events):
+        try:
+            # Times without an offset are the user's local time
+            start_time = parse(event["start_time"]).astimezone().isoformat()
+            end_time = parse(event["end_time"]).astimezone().isoformat()
+            attendees = [email.strip() for email in (event.get("attendees") or "").split(",") if email.strip()]
+            invalid_emails = [email for email in attendees if not is_valid_email(email)]
+            if invalid_emails:
+                raise ValueError(f"invalid attendee emails: {', '.join(invalid_emails)}")
+            bodies.append(event_body(
+                event["summary"], event.get("location", ""), event.get("description", ""), start_time, end_time, attendees
+            ))
+            positions.append(index)
+        except (KeyError, TypeError, ValueError, OverflowError) as e:
+            errors[index] = f"invalid event: {e}"
+
+    created = 0
+    if bodies:
+        try:
+            results = create_calendar_events(bodies)
+        except Exception as e:
+            return f"Couldn't connect to Google Calendar: {e}"
+        for index, (event, error) in zip(positions, results):
+            if error:
+                errors[index] = error
+            else:
+                created += 1
+
+    report = f"Created {created} of {len(events)} Google Calendar events."
+    for index in sorted(errors):
+        summary = events[index].get("summary") if isinstance(events[index], dict) else None
+        report += f"\nEvent {index + 1} ({summary or 'untitled'}) failed: {errors[index]}"
+    return report
@@ -0,0 +1,361 @@
+import bisect
+import datetime
+import threading
+import time
+
+from app_utils import run_applescript_capture
+
+app_name = "Calendar"
+
+FIELD_SEP = "\x1f"
+RECORD_SEP = "\x1e"
+
+# Handlers shared by the scripts below. Dates are built from numbers and printed as ISO 8601,
+# so nothing depends on the user's locale date format.
+DATE_HANDLERS = """
+on makeDate(y, m, d, s)
+    set theDate to current date
+    set day of theDate to 1
+    set year of theDate to y
+    set month of theDate to m
+    set day of theDate to d
+    set time of theDate to s
+    return theDate
+end makeDate
+
+on pad(n)
+    return text -2 thru -1 of ("0" & n)
+end pad
+
+on isoDate(d)
+    set s to time of d
+    return ((year of d) as text) & "-" & my pad((month of d) as integer) & "-" & my pad(day of d) & "T" & my pad(s div 3600) & ":" & my pad((s mod 3600) div 60) & ":" & my pad(s mod 60)
+end isoDate
+
+on textOrEmpty(value)
+    if value is missing value then return ""
+    return value as text
+end textOrEmpty
+"""
+
+
+def applescript_date(value):
+    return f"my makeDate({value.year}, {value.month}, {value.day}, {value.hour * 3600 + value.minute * 60 + value.second})"
+
+
+def fetch_script(range_start, range_end):
+    """
+    AppleScript returning every event overlapping [range_start, range_end) across all calendars,
+    one record per event. Properties are fetched in bulk per calendar.
+    Properties fetched by index belong to the right event only if the calendar didn't change between
+    the Apple events, so the uids are read again at the end; the script returns "changed" if they moved.
+    Attendees are looked up by uid, one event at a time.
+    """
+    return f"""
+    {DATE_HANDLERS}
+    set fieldSep to character id 31
+    set recordSep to character id 30
+    set rangeStart to {applescript_date(range_start)}
+    set rangeEnd to {applescript_date(range_end)}
+    set output to {{}}
+    tell application "{app_name}"
+        repeat with aCalendar in calendars
+            set calendarName to name of aCalendar
+            set theIds to uid of (every event of aCalendar whose start date < rangeEnd and end date > rangeStart)
+            if (count of theIds) > 0 then
+                set theTitles to summary of (every event of aCalendar whose start date < rangeEnd and end date > rangeStart)
+                set theStarts to start date of (every event of aCalendar whose start date < rangeEnd and end date > rangeStart)
+                set theEnds to end date of (every event of aCalendar whose start date < rangeEnd and end date > rangeStart)
+                set theLocations to location of (every event of aCalendar whose start date < rangeEnd and end date > rangeStart)
+                set theNotes to description of (every event of aCalendar whose start date < rangeEnd and end date > rangeStart)
+                repeat with i from 1 to count of theIds
+                    -- Attendees are optional and fail on some calendar types, so fail gracefully
+                    set attendeesText to ""
+                    try
+                        set AppleScript's text item delimiters to ", "
+                        set attendeesText to (display name of attendees of (first event of aCalendar whose uid is (item i of theIds))) as text
+                        set AppleScript's text item delimiters to ""
+                    end try
+                    set end of output to (item i of theIds) & fieldSep & calendarName & fieldSep & my textOrEmpty(item i of theTitles) & fieldSep & my isoDate(item i of theStarts) & fieldSep & my isoDate(item i of theEnds) & fieldSep & my textOrEmpty(item i of theLocations) & fieldSep & my textOrEmpty(item i of theNotes) & fieldSep & attendeesText
+                end repeat
+                set checkIds to uid of (every event of aCalendar whose start date < rangeEnd and end date > rangeStart)
+                if checkIds is not theIds then return "changed"
+            end if
+        end repeat
+    end tell
+    set AppleScript's text item delimiters to recordSep
+    set outputText to output as text
+    set AppleScript's text item delimiters to ""
+    return outputText
+    """
+
+
+def escape(text):
+    return (text or "").replace("\\", "\\\\").replace('"', '\\"')
+
+
+def create_script(calendar, events):
+    """
+    AppleScript creating all the events in the given calendar with one run. Each event is created in
+    its own try block, so one failure doesn't stop the batch. Returns one record per event, in order:
+    "ok" and the new uid, or "error" and the message.
+    """
+    dates = "\n".join(
+        f"set end of theDates to {{{applescript_date(event['start'])}, {applescript_date(event['end'])}}}"
+        for event in events
+    )
+    creates = "\n".join(
+        f"""
+            try
+                set newEvent to make new event at end with properties {{summary:"{escape(event['title'])}", start date:item 1 of item {index} of theDates, end date:item 2 of item {index} of theDates, location:"{escape(event.get('location'))}", description:"{escape(event.get('notes'))}"}}
+                set end of output to "ok" & fieldSep & (uid of newEvent)
+            on error errorMessage
+                set end of output to "error" & fieldSep & errorMessage
+            end try"""
+        for index, event in enumerate(events, start=1)
+    )
+    return f"""
+    {DATE_HANDLERS}
+    set fieldSep to character id 31
+    set recordSep to character id 30
+    set theDates to {{}}
+    {dates}
+    set output to {{}}
+    tell application "{app_name}"
+        tell calendar "{escape(calendar)}"
+            {creates}
+        end tell
+    end tell
+    set AppleScript's text item delimiters to recordSep
+    set outputText to output as text
+    set AppleScript's text item delimiters to ""
+    return outputText
+    """
+
+
+def parse_created(stdout):
+    """
+    Returns [(uid, None) or (None, error)] from the output of create_script.
+    """
+    results = []
+    for record in stdout.rstrip("\n").split(RECORD_SEP):
+        status, _, value = record.partition(FIELD_SEP)
+        results.append((value, None) if status == "ok" else (None, value or "Calendar.app returned nothing"))
+    return results
+
+
+def parse_events(stdout):
+    """
+    Event records of fetch_script, or None if a calendar changed while the script ran.
+    """
+    if stdout.strip() == "changed":
+        return None
+    events = []
+    for record in stdout.rstrip("\n").split(RECORD_SEP):
+        fields = record.split(FIELD_SEP)
+        if len(fields) != 8:
+            continue
+        uid, calendar, title, start, end, location, notes, attendees = fields
+        events.append(make_event(uid, calendar, title, start, end, location, notes, attendees))
+    return events
+
+
+def make_event(uid, calendar, title, start, end, location="", notes="", attendees=""):
+    return {
+        "uid": uid,
+        "calendar": calendar,
+        "title": title,
+        "start": start if isinstance(start, str) else start.isoformat(timespec="seconds"),
+        "end": end if isinstance(end, str) else end.isoformat(timespec="seconds"),
+        "location": location or None,
+        "notes": notes or None,
+        "attendees": [name for name in attendees.split(", ") if name] if isinstance(attendees, str) else attendees,
+    }
+
+
+class CalendarStore:
+    """
+    In-process copy of Calendar.app events with an interval index for date-range queries.
+
+    Days are synced from Calendar.app the first time they are queried. Days that were queried
+    recently are re-synced in the background once they are older than sync_interval, and writes
+    update the store directly and wake the background sync, so queries are answered without AppleScript.
+    """
+
+    def __init__(self, sync_interval=300, keep_warm=3600, sync_attempts=3):
+        self.sync_interval = sync_interval
+        self.keep_warm = keep_warm
+        self.sync_attempts = sync_attempts
+        self._events = {}  # uid -> event
+        self._starts = []  # sorted (start datetime, uid)
+        self._max_duration = datetime.timedelta(0)
+        self._synced = {}  # day -> monotonic time of the last sync
+        self._queried = {}  # day -> monotonic time of the last query
+        self._dirty = set()
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._worker = None
+
+    # Interval index
+
+    def _add(self, event):
+        self._remove(event["uid"])
+        start = datetime.datetime.fromisoformat(event["start"])
+        end = datetime.datetime.fromisoformat(event["end"])
+        self._events[event["uid"]] = event
+        bisect.insort(self._starts, (start, event["uid"]))
+        self._max_duration = max(self._max_duration, end - start)
+
+    def _remove(self, uid):
+        event = self._events.pop(uid, None)
+        if event is None:
+            return
+        key = (datetime.datetime.fromisoformat(event["start"]), uid)
+        index = bisect.bisect_left(self._starts, key)
+        if index < len(self._starts) and self._starts[index] == key:
+            del self._starts[index]
+
+    def _overlapping(self, range_start, range_end):
+        # An event overlapping the range can't start earlier than range_start minus the longest duration
+        low = bisect.bisect_left(self._starts, (range_start - self._max_duration, ""))
+        high = bisect.bisect_left(self._starts, (range_end, ""))
+        events = []
+        for start, uid in self._starts[low:high]:
+            event = self._events[uid]
+            if datetime.datetime.fromisoformat(event["end"]) > range_start:
+                events.append(event)
+        return events
+
+    # Syncing
+
+    def sync(self, first_day, last_day):
+        """
+        Replaces the stored events overlapping the given days with a fresh copy from Calendar.app.
+        """
+        range_start = datetime.datetime.combine(first_day, datetime.time())
+        range_end = datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time())
+        for attempt in range(self.sync_attempts):
+            stdout, stderr = run_applescript_capture(fetch_script(range_start, range_end))
+            if stderr:
+                raise RuntimeError(stderr.strip())
+            events = parse_events(stdout)
+            if events is not None:
+                break
+            # An event was created or deleted while the script ran, the indexes moved
+        else:
+            raise RuntimeError("The calendar kept changing while it was read, try again")
+        now = time.monotonic()
+        with self._lock:
+            for event in self._overlapping(range_start, range_end):
+                self._remove(event["uid"])
+            for event in events:
+                self._add(event)
+            for day in _days(first_day, last_day):
+                self._synced[day] = now
+                self._dirty.discard(day)
+
+    def _sync_days(self, days):
+        # Sync contiguous runs of days with one script each
+        for first_day, last_day in _runs(sorted(days)):
+            self.sync(first_day, last_day)
+
+    def query(self, first_day, last_day):
+        """
+        Returns the events overlapping the given days, sorted by start. Days never synced are
+        fetched now; stale days are served from the store and refreshed in the background.
+        """
+        now = time.monotonic()
+        days = list(_days(first_day, last_day))
+        with self._lock:
+            missing = [day for day in days if day not in self._synced]
+            for day in days:
+                self._queried[day] = now
+        if missing:
+            self._sync_days(missing)
+        self._ensure_worker()
+        range_start = datetime.datetime.combine(first_day, datetime.time())
+        range_end = datetime.datetime.combine(last_day + datetime.timedelta(days=1), datetime.time())
+        with self._lock:
+            return [dict(event) for event in self._overlapping(range_start, range_end)]
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="calendar-sync", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.sync_interval)
+            self._wakeup.clear()
+            now = time.monotonic()
+            with self._lock:
+                # Forget days nobody asked about for a while instead of keeping them in sync forever
+                for day, queried_at in list(self._queried.items()):
+                    if now - queried_at > self.keep_warm:
+                        del self._queried[day]
+                        self._synced.pop(day, None)
+                stale = {
+                    day for day in self._queried
+                    if day in self._dirty or now - self._synced.get(day, 0) > self.sync_interval
+                }
+            try:
+                self._sync_days(stale)
+            except Exception as e:
+                print(f"Calendar sync failed: {e}")
+
+    # Write-through
+
+    def added(self, event):
+        """
+        Records an event just created in Calendar.app and schedules a re-sync of its days.
+        """
+        with self._lock:
+            self._add(event)
+            self._mark_dirty(event["start"], event["end"])
+
+    def deleted(self, title, start, calendar=None):
+        """
+        Drops events just deleted from Calendar.app and schedules a re-sync of their days.
+        """
+        start = start if isinstance(start, str) else start.isoformat(timespec="seconds")
+        with self._lock:
+            for uid, event in list(self._events.items()):
+                if event["title"] == title and event["start"] == start and calendar in (None, event["calendar"]):
+                    self._remove(uid)
+                    self._mark_dirty(event["start"], event["end"])
+
+    def _mark_dirty(self, start, end):
+        first_day = datetime.datetime.fromisoformat(start).date()
+        last_day = datetime.datetime.fromisoformat(end).date()
+        self._dirty.update(day for day in _days(first_day, last_day) if day in self._synced)
+        self._wakeup.set()
+
+
+def _days(first_day, last_day):
+    day = first_day
+    while day <= last_day:
+        yield day
+        day += datetime.timedelta(days=1)
+
+
+def _runs(days):
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][1] == datetime.timedelta(days=1):
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return runs
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CalendarStore()
+        return _store
@@ -1,89 +1,77 @@
 import platform
-from app_utils import run_applescript_capture
+from tools.contacts_index import get_index
+from tools.registry import tool
+
+def not_found_message(contact_name):
+    names = Contacts.get_full_names_from_first_name(contact_name)
+    if names == "No contacts found.":
+        return "No contacts found"
+    else:
+        # Language model friendly error message
+        return f"A contact for '{contact_name}' was not found, perhaps one of these similar contacts might be what you are looking for? {names} \n Please try again and provide a more specific contact name."
 
 class Contacts:
     @staticmethod
+    @tool()
     def get_phone_number(contact_name):
-        print ("The contact name is:", contact_name)
-
         """
         Returns the phone number of a contact by name.
+
+        Args:
+        contact_name (str): Name of the contact to get the phone number for.
         """
+        print ("The contact name is:", contact_name)
         if platform.system() != 'Darwin':
             return "This method is only supported on MacOS"
-        
-        script = f'''
-        tell application "Contacts"
-            set thePerson to first person whose name is "{contact_name}"
-            set theNumber to value of first phone of thePerson
-            return theNumber
-        end tell
-        '''
-        stout, stderr = run_applescript_capture(script)
+
+        matches = get_index().lookup(contact_name)
         # If the person is not found, we will try to find similar contacts
-        if "Can’t get person" in stderr:
-            names= Contacts.get_full_names_from_first_name(contact_name)
-            if names == "No contacts found":
-                return "No contacts found"
-            else:
-                # Language model friendly error message
-                return f"A contact for '{contact_name}' was not found, perhaps one of these similar contacts might be what you are looking for? {names} \n Please try again and provide a more specific contact name."
-        else:
-            print ("The phone number is:", stout.replace('\n', ''))
-            return stout.replace('\n', '')
+        if not matches:
+            return not_found_message(contact_name)
+        for contact in matches:
+            if contact["phones"]:
+                print ("The phone number is:", contact["phones"][0])
+                return contact["phones"][0]
+        return f"{matches[0]['name']} has no phone number saved in Contacts."
 
     @staticmethod
+    @tool()
     def get_email_address(contact_name):
-        print ("The contact name is:", contact_name)    
         """
         Returns the email address of a contact by name.
+
+        Args:
+        contact_name (str): The name of the contact to retrieve the email address for
         """
+        print ("The contact name is:", contact_name)
         if platform.system() != 'Darwin':
             return "This method is only supported on MacOS"
-        
-        script = f'''
-        tell application "Contacts"
-            set thePerson to first person whose name is "{contact_name}"
-            set theEmail to value of first email of thePerson
-            return theEmail
-        end tell
-        '''
-        stout, stderr = run_applescript_capture(script)
+
+        matches = get_index().lookup(contact_name)
         # If the person is not found, we will try to find similar contacts
-        if "Can’t get person" in stderr:
-            names= Contacts.get_full_names_from_first_name(contact_name)
-            if names == "No contacts found":
-                return "No contacts found"
-            else:
-                # Language model friendly error message
-                return f"A contact for '{contact_name}' was not found, perhaps one of these similar contacts might be what you are looking for? {names} \n Please try again and provide a more specific contact name."
-        else:
-            return stout.replace('\n', '')
+        if not matches:
+            return not_found_message(contact_name)
+        for contact in matches:
+            if contact["emails"]:
+                return contact["emails"][0]
+        return f"{matches[0]['name']} has no email address saved in Contacts."
 
     @staticmethod
-    def get_full_names_from_first_name(contact, first_name):
-        
+    @tool()
+    def get_full_names_from_first_name(first_name):
         """
         Returns a list of full names of contacts that contain the first name provided.
+
+        Args:
+        first_name (str): The first name to filter contacts by.
         """
         if platform.system() != 'Darwin':
             return "This method is only supported on MacOS"
-        
-        script = f'''
-        tell application "Contacts"
-            set matchingPeople to every person whose name contains "{first_name}"
-            set namesList to {{}}
-            repeat with aPerson in matchingPeople
-                set end of namesList to name of aPerson
-            end repeat
-            return namesList
-        end tell
-        '''
-        names, _ = run_applescript_capture(script)
+
+        names = [contact["name"] for contact in get_index().similar(first_name)]
 
         print ("The full names are:", names)
         if names:
-            return names
+            return ", ".join(names)
         else:
             return "No contacts found."
-        
\ No newline at end of file
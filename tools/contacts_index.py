@@ -0,0 +1,215 @@
+import bisect
+import difflib
+import json
+import os
+import threading
+import time
+
+from app_utils import run_applescript_capture
+
+CACHE_DIR = os.path.expanduser(os.environ.get("FLOWCHAIN_CACHE_DIR", "~/.flowchain"))
+
+# Separators that can't appear in contact fields: unit (field), record and group (list items)
+FIELD_SEP = "\x1f"
+RECORD_SEP = "\x1e"
+LIST_SEP = "\x1d"
+
+
+def export_script(people):
+    """
+    AppleScript exporting id, name, phones and emails of the given people specifier in bulk.
+    Each property is fetched for all matching people with one Apple event instead of one query per person.
+    """
+    return f"""
+    set fieldSep to character id 31
+    set recordSep to character id 30
+    set listSep to character id 29
+    tell application "Contacts"
+        set theIds to id of ({people})
+        set theNames to name of ({people})
+        set thePhones to value of phones of ({people})
+        set theEmails to value of emails of ({people})
+    end tell
+    set output to {{}}
+    repeat with i from 1 to count of theIds
+        set theName to item i of theNames
+        if theName is missing value then set theName to ""
+        set AppleScript's text item delimiters to listSep
+        set phoneText to (item i of thePhones) as text
+        set emailText to (item i of theEmails) as text
+        set end of output to (item i of theIds) & fieldSep & theName & fieldSep & phoneText & fieldSep & emailText
+    end repeat
+    set AppleScript's text item delimiters to recordSep
+    set outputText to output as text
+    set AppleScript's text item delimiters to ""
+    return outputText
+    """
+
+
+def parse_export(stdout):
+    contacts = []
+    for record in stdout.rstrip("\n").split(RECORD_SEP):
+        fields = record.split(FIELD_SEP)
+        if len(fields) != 4:
+            continue
+        contact_id, name, phones, emails = fields
+        contacts.append({
+            "id": contact_id,
+            "name": name,
+            "phones": [phone for phone in phones.split(LIST_SEP) if phone],
+            "emails": [email for email in emails.split(LIST_SEP) if email],
+        })
+    return contacts
+
+
+class ContactsIndex:
+    """
+    Local snapshot of the address book with exact, prefix and fuzzy name lookup done in Python.
+    The snapshot is exported in bulk once, cached on disk and refreshed incrementally with
+    only the people modified since the last sync.
+    """
+
+    def __init__(self, path=None, refresh_interval=300):
+        self.path = path or os.path.join(CACHE_DIR, "contacts.json")
+        self.refresh_interval = refresh_interval
+        self.synced_at = 0
+        self._contacts = {}  # id -> contact
+        self._by_name = {}  # lowercase full name -> [contact]
+        self._prefixes = []  # sorted (lowercase name or word, contact id)
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            return
+        self.synced_at = snapshot.get("synced_at", 0)
+        self._contacts = {contact["id"]: contact for contact in snapshot.get("contacts", [])}
+        self._rebuild()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump({"synced_at": self.synced_at, "contacts": list(self._contacts.values())}, file)
+        os.replace(tmp_path, self.path)
+
+    def _rebuild(self):
+        by_name = {}
+        prefixes = []
+        for contact in self._contacts.values():
+            name = contact["name"].lower()
+            if not name:
+                continue
+            by_name.setdefault(name, []).append(contact)
+            # Index the full name and every word in it, so "smith" finds "John Smith"
+            keys = {name, *name.split()}
+            prefixes.extend((key, contact["id"]) for key in keys)
+        prefixes.sort()
+        self._by_name = by_name
+        self._prefixes = prefixes
+
+    def refresh(self, full=False):
+        """
+        Syncs the snapshot with Contacts.app. Without a previous sync, or with full=True, everyone
+        is exported; otherwise only people modified since the last sync are fetched.
+        """
+        with self._lock:
+            started_at = time.time()
+            if full or not self.synced_at:
+                stdout, stderr = run_applescript_capture(export_script("every person"))
+                if stderr:
+                    raise RuntimeError(stderr.strip())
+                self._contacts = {contact["id"]: contact for contact in parse_export(stdout)}
+            else:
+                # A small overlap guards against clock skew between the sync and the export
+                seconds = int(started_at - self.synced_at) + 60
+                stdout, stderr = run_applescript_capture(
+                    export_script(f"every person whose modification date > ((current date) - {seconds})")
+                )
+                if stderr:
+                    raise RuntimeError(stderr.strip())
+                for contact in parse_export(stdout):
+                    self._contacts[contact["id"]] = contact
+                # Deleted people only show up as ids missing from the full id list
+                ids, stderr = run_applescript_capture(
+                    'set AppleScript\'s text item delimiters to character id 30\n'
+                    'tell application "Contacts" to set theIds to id of every person\n'
+                    'return theIds as text'
+                )
+                if not stderr:
+                    current = set(ids.rstrip("\n").split(RECORD_SEP))
+                    self._contacts = {key: value for key, value in self._contacts.items() if key in current}
+            self.synced_at = started_at
+            self._rebuild()
+            self._save()
+
+    def ensure_fresh(self):
+        if time.time() - self.synced_at > self.refresh_interval:
+            self.refresh()
+
+    def exact(self, name):
+        with self._lock:
+            return list(self._by_name.get(name.strip().lower(), []))
+
+    def prefix(self, text, limit=10):
+        text = text.strip().lower()
+        if not text:
+            return []
+        with self._lock:
+            matches = []
+            seen = set()
+            index = bisect.bisect_left(self._prefixes, (text, ""))
+            while index < len(self._prefixes) and self._prefixes[index][0].startswith(text):
+                contact_id = self._prefixes[index][1]
+                if contact_id not in seen:
+                    seen.add(contact_id)
+                    matches.append(self._contacts[contact_id])
+                    if len(matches) >= limit:
+                        break
+                index += 1
+            return matches
+
+    def fuzzy(self, text, limit=5, cutoff=0.6):
+        with self._lock:
+            names = difflib.get_close_matches(text.strip().lower(), list(self._by_name), n=limit, cutoff=cutoff)
+            return [contact for name in names for contact in self._by_name[name]]
+
+    def lookup(self, name):
+        """
+        Returns the contacts exactly matching a name. A miss triggers one incremental refresh,
+        in case the contact was added since the last sync.
+        """
+        self.ensure_fresh()
+        matches = self.exact(name)
+        if not matches and time.time() - self.synced_at > 5:
+            self.refresh()
+            matches = self.exact(name)
+        return matches
+
+    def similar(self, name, limit=10):
+        """
+        Contacts whose name or a word of it starts with the given text, then close spellings.
+        """
+        self.ensure_fresh()
+        matches = self.prefix(name, limit)
+        seen = {contact["id"] for contact in matches}
+        for contact in self.fuzzy(name):
+            if contact["id"] not in seen and len(matches) < limit:
+                seen.add(contact["id"])
+                matches.append(contact)
+        return matches
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ContactsIndex()
+        return _index
@@ -1,22 +1,22 @@
 import subprocess
-import openai
-from openai import OpenAI
-
-client = OpenAI()
+from app_utils import run_applescript_capture
+from clients import get_openai
+from tools.registry import tool
 
+@tool(background=True)
 def generate_and_execute_applescript(description):
     """
-    Generates AppleScript using OpenAI's GPT-4 Turbo and executes it.
+    Generates the required AppleScript and executes within the terminal.
 
     Args:
-    description (str): A description of the task for which AppleScript is needed.
+    description (str): The description of the AppleScript to be executed
 
     Returns:
     dict: A dictionary containing the 'output' from executing the AppleScript or 'error' if it fails.
     """
     try:
         # Call to OpenAI's API to generate AppleScript
-        response = client.chat.completions.create(
+        response = get_openai().chat.completions.create(
             model="gpt-4-turbo",
             messages=[{"role": "system", "content": f"Write an AppleScript that accomplishes the following task: {description}\n Only return the AppleScript code that is meant to be executed. Do not include any additional text or comments in the response including 'applescript'"}],
             max_tokens=150
@@ -26,15 +26,12 @@ def generate_and_execute_applescript(description):
         applescript_code = response.choices[0].message.content.strip()
         print("Generated AppleScript:", applescript_code)
 
-        # Prepare the command to run the generated AppleScript using osascript
-        command = ['osascript', '-e', applescript_code]
-
-        # Execute the command
-        print("Executing AppleScript:", command)
-        result = subprocess.run(command, text=True, capture_output=True, check=True)
-        return {"output": result.stdout}
-    except subprocess.CalledProcessError as e:
-        return {"error": e.stderr}
+        # Execute the generated AppleScript on a resident osascript worker
+        print("Executing AppleScript:", applescript_code)
+        stdout, stderr = run_applescript_capture(applescript_code)
+        if stderr:
+            return {"error": stderr}
+        return {"output": stdout}
     except Exception as e:
         return {"error": str(e)}
 
@@ -90,12 +87,13 @@ def generate_and_execute_applescript(description):
 #     except Exception as e:
 #         return {"error": str(e)}
 
+@tool()
 def execute_command(command):
     """
-    Executes a given command line command using subprocess and captures the output and any errors.
+    Executes any command in the terminal and returns the output.
 
     Args:
-    command (list): The command to execute, provided as a list where the command and its arguments are separate items.
+    command (str): The command to be executed in the terminal
 
     Returns:
     dict: A dictionary containing the 'output' if the command was successful, or 'error' if it failed.
@@ -1,7 +1,5 @@
-import requests
 import json
 import os
-from tavily import TavilyClient
 # import contacts
 # import inspect
 
@@ -12,13 +10,15 @@ from tavily import TavilyClient
 
 # Get ACCESS_TOKEN from environment variable
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
-TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 
 import datetime
 import platform
 import subprocess
 # from app_utils import run_applescript, run_applescript_capture
-import pyautogui
+from tools.registry import tool
+
+# HTTP and Tavily clients are shared and pooled (see clients.py), created the first time a tool needs them
+from clients import HTTP_TIMEOUT, get_http_session, get_tavily
 
 calendar_app = "Calendar"
 
@@ -43,8 +43,15 @@ calendar_app = "Calendar"
 
 # Example dummy function hard coded to return the same weather
 # In production, this could be your backend API or an external API
+@tool(enums={"unit": ["celsius", "fahrenheit"]})
 def get_current_weather(location, unit="fahrenheit"):
-    """Get the current weather in a given location"""
+    """
+    Get the current weather in a given location
+
+    Args:
+    location (str): The city and state, e.g., San Francisco, CA
+    unit (str): The unit of temperature
+    """
     if "tokyo" in location.lower():
         return json.dumps({"location": "Tokyo", "temperature": "10", "unit": unit})
     elif "san francisco" in location.lower():
@@ -55,7 +62,18 @@ def get_current_weather(location, unit="fahrenheit"):
         return json.dumps({"location": location, "temperature": "unknown"})
 
 # Function to call the external API for paraphrasing
+@tool(enums={"plan": ["paid"], "prefer_gpt": ["gpt3"], "language": ["EN_US"]})
 def paraphrase_text(text, plan="paid", prefer_gpt="gpt3", custom_style="", language="EN_US"):
+    """
+    Paraphrases the provided text using an external API
+
+    Args:
+    text (str): The text to be paraphrased
+    plan (str): Type of plan
+    prefer_gpt (str): Preferred GPT model
+    custom_style (str): Custom styling for the paraphrasing
+    language (str): Language of the text
+    """
     url = "https://api-yomu-writer-470e5c0e3608.herokuapp.com/paraphrase"
     headers = {
         "accept": "application/json",
@@ -70,7 +88,7 @@ def paraphrase_text(text, plan="paid", prefer_gpt="gpt3", custom_style="", langu
         "language": language
     })
 
-    response = requests.post(url, headers=headers, data=payload)
+    response = get_http_session().post(url, headers=headers, data=payload, timeout=HTTP_TIMEOUT)
     if response.status_code == 200:
         # print (response.json())
         return response.json()  # Return the JSON response from the API
@@ -79,13 +97,22 @@ def paraphrase_text(text, plan="paid", prefer_gpt="gpt3", custom_style="", langu
 
 # def write_message_with_keyboard(message):
 #     # Type and send the message
+#     import pyautogui
 #     pyautogui.write(message)
 #     return "Message sent successfully as: " + message
 #     # pyautogui.press('return')
 
 # run_shortcut function
+# On the server it runs as a job and the acceptance message is the reply; the template reply is
+# used by the desktop app (flowchain.py), which calls tools inline
+@tool(policy="template", template='Ran the "{shortcut}" shortcut.', success="Sucessfully run shortcut", background=True)
 def run_shortcut (shortcut: str) -> str:
-    "Runs given shortcut"
+    """
+    Runs a MacOS shortcut using the app Shortcuts given an shortcut argument
+
+    Args:
+    shortcut (str): Name of the shortcut
+    """
     try:
         os.system ("shortcuts run " + "'" + shortcut +"'")
         return "Sucessfully run shortcut " + shortcut
@@ -94,7 +121,11 @@ def run_shortcut (shortcut: str) -> str:
         return e
 
 # Get a list of shortcuts
+@tool()
 def get_shortcuts ():
+    """
+    Returns a list of shortcuts available in the MacOS app 'Shortcuts'
+    """
     # stdout, stderr = os.system("shortcuts list")  # Execute command and store stdout &stderr
 
     # Execute the shell command and capture its output  
@@ -104,13 +135,15 @@ def get_shortcuts ():
     output = output.split("\n")[:-1]
     return output
 
+@tool()
 def web_search (query: str):
     """
-    Searches the web for the given query
-    """
+    Use Tavily to search the web for the given query
 
-    tavily = TavilyClient(api_key=TAVILY_API_KEY)
-    response = tavily.search(query=query)
+    Args:
+    query (str): The query to search the web for
+    """
+    response = get_tavily().search(query=query)
     # print (response["results"])
     context = [{"url": obj["url"], "content": obj["content"]} for obj in response["results"]]
     # print (context)
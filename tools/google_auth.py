@@ -0,0 +1,85 @@
+import os
+import threading
+
+CACHE_DIR = os.path.expanduser(os.environ.get("FLOWCHAIN_CACHE_DIR", "~/.flowchain"))
+
+SCOPES = ["https://www.googleapis.com/auth/calendar"]
+
+# OAuth client downloaded from the Google Cloud console, and where the user's tokens are kept
+CLIENT_SECRET_PATH = os.environ.get("FLOWCHAIN_GOOGLE_CLIENT_SECRET", "client_secret.json")
+TOKEN_PATH = os.path.expanduser(os.environ.get("FLOWCHAIN_GOOGLE_TOKEN", os.path.join(CACHE_DIR, "google_token.json")))
+
+_credentials = None
+_credentials_lock = threading.Lock()
+# httplib2, which the API client uses underneath, isn't thread-safe, so each thread gets its own service
+_services = threading.local()
+
+
+def _save(credentials, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    # The refresh token grants calendar access, keep it readable by the user only
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as file:
+        file.write(credentials.to_json())
+    os.replace(tmp_path, path)
+
+
+def get_credentials():
+    """
+    Google credentials for the Calendar API. The browser consent flow only runs when there is
+    no saved token, expired access tokens are refreshed and saved back to TOKEN_PATH.
+    """
+    global _credentials
+    with _credentials_lock:
+        credentials = _credentials
+        if credentials is None and os.path.exists(TOKEN_PATH):
+            from google.oauth2.credentials import Credentials
+            credentials = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES)
+
+        if credentials is not None and credentials.valid:
+            _credentials = credentials
+            return credentials
+
+        if credentials is not None and credentials.expired and credentials.refresh_token:
+            from google.auth.exceptions import RefreshError
+            from google.auth.transport.requests import Request
+            try:
+                credentials.refresh(Request())
+            except RefreshError as e:
+                # Revoked or expired refresh token, ask for consent again
+                print(f"Google token refresh failed: {e}")
+                credentials = None
+        else:
+            credentials = None
+
+        if credentials is None:
+            from google_auth_oauthlib.flow import InstalledAppFlow
+            flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET_PATH, scopes=SCOPES)
+            credentials = flow.run_local_server(port=0)
+
+        _save(credentials, TOKEN_PATH)
+        _credentials = credentials
+        return credentials
+
+
+def has_credentials():
+    """
+    Whether a Google account is connected, i.e. get_credentials() won't have to open a browser.
+    """
+    return _credentials is not None or os.path.exists(TOKEN_PATH)
+
+
+def get_calendar_service():
+    """
+    Calendar API service, built once per thread from the discovery document shipped with the
+    client library (static_discovery) instead of fetching it on every call. The credentials
+    refresh themselves as requests are made.
+    """
+    credentials = get_credentials()
+    cached = getattr(_services, "calendar", None)
+    # Rebuilt only if the user had to sign in again and the credentials were replaced
+    if cached is None or cached[0] is not credentials:
+        from googleapiclient.discovery import build
+        service = build("calendar", "v3", credentials=credentials, static_discovery=True, cache_discovery=False)
+        cached = _services.calendar = (credentials, service)
+    return cached[1]
@@ -0,0 +1,32 @@
+from job_queue import get_queue
+from tools.registry import tool
+
+
+@tool()
+def get_job_status(job_id: str):
+    """
+    Returns the status of a background job (queued, running, succeeded, failed or cancelled) and its result once done.
+
+    Args:
+    job_id (str): The job id given when the job was started
+    """
+    job = get_queue().get(job_id)
+    if job is None:
+        return f"No job with id {job_id}."
+    return job
+
+
+@tool(policy="final", success="Cancelled")
+def cancel_job(job_id: str):
+    """
+    Cancels a background job that hasn't finished yet.
+
+    Args:
+    job_id (str): The job id given when the job was started
+    """
+    job = get_queue().cancel(job_id)
+    if job is None:
+        return f"No job with id {job_id}."
+    if job["status"] != "cancelled":
+        return f"Job {job_id} already {job['status']}, it can't be cancelled."
+    return f"Cancelled job {job_id} ({job['tool']})."
@@ -1,12 +1,14 @@
 import subprocess
 from urllib.parse import quote
+from tools.registry import tool
 
+@tool(policy="template", template="Opened {location} in Google Maps.", success="Google Maps opened")
 def search_google_maps(location):
     """
-    Opens the specified location in Google Maps using a command line instruction to open the web browser.
+    Search for a location on Google Maps
 
     Args:
-    location (str): The location to search for, as an address or place name.
+    location (str): The location to search for
 
     Returns:
     str: A message indicating that the command was executed, or an error message if it fails.
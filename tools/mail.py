@@ -1,17 +1,27 @@
 import os
 import platform
-import re
-import subprocess
 
 from app_utils import *
+from tools.mail_store import get_store
+from tools.outbox import get_outbox
+from tools.registry import tool
 
 app_name = "Mail"
 
 class Mail:
     @staticmethod
-    def get_email(number=5, unread: bool = False):
+    @tool(required=["number"])
+    def get_email(number=5, unread: bool = False, include_body: bool = False):
         """
-        Retrieves the last {number} emails from the inbox, optionally filtering for only unread emails.
+        Retrieves the last emails from the inbox, optionally filtering for only unread emails.
+
+        Args:
+        number (int): Number of emails to retrieve
+        unread (bool): Filter for only unread emails
+        include_body (bool): Also return the content of each email, use get_email_content for a single one instead
+
+        Returns:
+        list: Emails with id, subject, sender, date and read status, newest first.
         """
         if platform.system() != "Darwin":
             return "This method is only supported on MacOS"
@@ -20,45 +30,53 @@ class Mail:
         if number > 50:
             number = min(number, 50)
             too_many_emails_msg = (
-                "This method is limited to 10 emails, returning the first 10: "
+                "This method is limited to 50 emails, returning the first 50."
             )
-        # This is set up to retry if the number of emails is less than the number requested, but only a max of three times
-        retries = 0  # Initialize the retry counter
-        while retries < 3:
-            read_status_filter = "whose read status is false" if unread else ""
-            script = f"""
-            tell application "{app_name}"
-                set latest_messages to messages of inbox {read_status_filter}
-                set email_data to {{}}
-                repeat with i from 1 to {number}
-                    set this_message to item i of latest_messages
-                    set end of email_data to {{subject:subject of this_message, sender:sender of this_message, content:content of this_message}}
-                end repeat
-                return email_data
-            end tell
-            """
-            stdout, stderr = run_applescript_capture(script)
-
-            # if the error is due to not having enough emails, retry with the available emails.
-            if "Can’t get item" in stderr:
-                match = re.search(r"Can’t get item (\d+) of", stderr)
-                if match:
-                    available_emails = int(match.group(1)) - 1
-                    if available_emails > 0:
-                        number = available_emails
-                        retries += 1
-                        continue
-                break
-            elif stdout:
-                if too_many_emails_msg:
-                    return f"{too_many_emails_msg}\n\n{stdout}"
-                else:
-                    return stdout
+        # Headers come from the local mail store, only mail that arrived since the last call is fetched
+        store = get_store()
+        try:
+            emails = store.latest(number, unread)
+            if include_body:
+                for email in emails:
+                    email["content"] = store.body(email["id"])
+        except RuntimeError as e:
+            return str(e)
+
+        if not emails:
+            return "No unread emails in the inbox." if unread else "The inbox is empty."
+        if too_many_emails_msg:
+            return {"note": too_many_emails_msg, "emails": emails}
+        return emails
+
+    @staticmethod
+    @tool()
+    def get_email_content(message_id: int):
+        """
+        Returns the full content of an email, given its id from get_email.
+
+        Args:
+        message_id (int): The id of the email
+        """
+        if platform.system() != "Darwin":
+            return "This method is only supported on MacOS"
+
+        try:
+            return get_store().body(message_id)
+        except RuntimeError as e:
+            return str(e)
 
     @staticmethod
+    @tool(policy="final", success="Email to .* queued")
     def send_email(to, subject, body, attachments=None):
         """
-        Sends an email with the given parameters using the default mail app.
+        Sends an email with the given parameters using the default mail app. The email is sent in the
+        background, this returns a job id right away; get_email_status tells when it has been sent.
+
+        Args:
+        to (str): Email address of the recipient
+        subject (str): Subject of the email
+        body (str): Body/content of the email
+        attachments (list): List of paths to the files to be attached
         """
         if platform.system() != "Darwin":
             return "This method is only supported on MacOS"
@@ -66,45 +84,34 @@ class Mail:
         # Strip newlines from the to field
         to = to.replace("\n", "")
 
-        attachment_clause = ""
-        delay_seconds = 5  # Default delay in seconds
-
+        formatted_attachments = [
+            Mail.format_path_for_applescript(path) for path in attachments or []
+        ]
+        # The outbox waits for Mail to load the attachments, the estimate only bounds how long
+        upload_timeout = 30
         if attachments:
-            formatted_attachments = [
-                Mail.format_path_for_applescript(path) for path in attachments
-            ]
-
-            # Generate AppleScript to attach each file
-            attachment_clause = "\n".join(
-                f"make new attachment with properties {{file name:{path}}} at after the last paragraph of the content of new_message"
-                for path in formatted_attachments
-            )
+            upload_timeout = max(upload_timeout, Mail.calculate_upload_delay(attachments) * 4)
 
-            # Calculate the delay based on the size of the attachments
-            delay_seconds = Mail.calculate_upload_delay(attachments)
+        # In the future, we might consider allowing the llm to specify an email to send from
+        job_id = get_outbox().submit(to, subject, body, formatted_attachments, upload_timeout)
+        return f"Email to {to} queued for sending (job {job_id})."
 
-            print(f"Uploading attachments. This should take ~{delay_seconds} seconds.")
+    @staticmethod
+    @tool()
+    def get_email_status(job_id: str):
+        """
+        Returns the status of an email queued by send_email: queued, composing, sending, sent, sent_unconfirmed (Mail accepted it but it isn't in Sent yet) or failed.
 
-        # In the future, we might consider allowing the llm to specify an email to send from
-        script = f"""
-        tell application "{app_name}"
-            set new_message to make new outgoing message with properties {{subject:"{subject}", content:"{body}"}} at end of outgoing messages
-            tell new_message
-                set visible to true
-                make new to recipient at end of to recipients with properties {{address:"{to}"}}
-                {attachment_clause}
-            end tell
-            {f'delay {delay_seconds}' if attachments else ''}
-            send new_message
-        end tell
+        Args:
+        job_id (str): The job id returned by send_email
         """
-        try:
-            run_applescript(script)
-            return f"""Email sent to {to}"""
-        except subprocess.CalledProcessError:
-            return "Failed to send email"
-   
+        job = get_outbox().status(job_id)
+        if job is None:
+            return f"No email job with id {job_id}."
+        return job
+
     @staticmethod
+    @tool(policy="template", template="You have {result} unread emails.", success=r"\d")
     def unread_count():
         """
         Retrieves the count of unread emails in the inbox, limited to 50.
@@ -112,24 +119,15 @@ class Mail:
         if platform.system() != "Darwin":
             return "This method is only supported on MacOS"
 
-        script = f"""
-            tell application "{app_name}"
-                set unreadMessages to (messages of inbox whose read status is false)
-                if (count of unreadMessages) > 50 then
-                    return 50
-                else
-                    return count of unreadMessages
-                end if
-            end tell
-            """
+        # Counted by the same sync that keeps the mail store's headers fresh
         try:
-            unreads = int(run_applescript(script))
-            if unreads >= 50:
-                return "50 or more"
-            return unreads
-        except subprocess.CalledProcessError as e:
+            unreads = get_store().unread_count()
+        except RuntimeError as e:
             print(e)
-            return 0
+            return str(e)
+        if unreads >= 50:
+            return "50 or more"
+        return unreads
 
     @staticmethod
     # Estimate how long something will take to upload
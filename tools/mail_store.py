@@ -0,0 +1,260 @@
+import threading
+import time
+from collections import OrderedDict
+
+from app_utils import run_applescript_capture
+from tools.calendar_store import DATE_HANDLERS
+
+app_name = "Mail"
+
+FIELD_SEP = "\x1f"
+RECORD_SEP = "\x1e"
+
+
+def sync_script(limit, known_ids):
+    """
+    AppleScript returning the inbox state in one run: the total count, the ids of all unread messages,
+    the ids and read status of the newest `limit` messages, and subject, sender and date of the ones
+    not in known_ids. Every property is fetched for a range of messages with one Apple event, never
+    one message at a time. New mail arrives at the top of the inbox, so headers are only fetched down
+    to the last unknown message.
+    Properties fetched by index belong to the right message only if the inbox didn't change between
+    the Apple events, so the ids are read again at the end; the script returns "changed" if they moved.
+    """
+    known = ", ".join(str(message_id) for message_id in known_ids)
+    return f"""
+    {DATE_HANDLERS}
+    set fieldSep to character id 31
+    set recordSep to character id 30
+    set knownIds to {{{known}}}
+    tell application "{app_name}"
+        set total to count of messages of inbox
+        set unreadIds to id of (messages of inbox whose read status is false)
+        set n to total
+        if n > {limit} then set n to {limit}
+        set theIds to {{}}
+        set theReads to {{}}
+        if n > 0 then
+            set theIds to id of messages 1 thru n of inbox
+            set theReads to read status of messages 1 thru n of inbox
+        end if
+        set k to 0
+        repeat with i from 1 to n
+            if (item i of theIds) is not in knownIds then set k to i
+        end repeat
+        set theSubjects to {{}}
+        set theSenders to {{}}
+        set theDates to {{}}
+        if k > 0 then
+            set theSubjects to subject of messages 1 thru k of inbox
+            set theSenders to sender of messages 1 thru k of inbox
+            set theDates to date received of messages 1 thru k of inbox
+        end if
+        set checkIds to {{}}
+        if n > 0 then set checkIds to id of messages 1 thru n of inbox
+        if checkIds is not theIds then return "changed"
+    end tell
+    set AppleScript's text item delimiters to fieldSep
+    set unreadText to unreadIds as text
+    set AppleScript's text item delimiters to ""
+    set output to {{(total as text), unreadText}}
+    repeat with i from 1 to n
+        set theRecord to ((item i of theIds) as text) & fieldSep & ((item i of theReads) as text)
+        if i <= k then
+            set theRecord to theRecord & fieldSep & my textOrEmpty(item i of theSubjects) & fieldSep & my textOrEmpty(item i of theSenders) & fieldSep & my isoDate(item i of theDates)
+        end if
+        set end of output to theRecord
+    end repeat
+    set AppleScript's text item delimiters to recordSep
+    set outputText to output as text
+    set AppleScript's text item delimiters to ""
+    return outputText
+    """
+
+
+def parse_sync(stdout):
+    """
+    Returns (total, unread ids, [(id, read, headers or None)]) in inbox order,
+    or None if the inbox changed while the script ran.
+    """
+    if stdout.strip() == "changed":
+        return None
+    records = stdout.rstrip("\n").split(RECORD_SEP)
+    total = int(records[0])
+    unread_ids = [int(value) for value in records[1].split(FIELD_SEP) if value]
+    messages = []
+    for record in records[2:]:
+        fields = record.split(FIELD_SEP)
+        if len(fields) not in (2, 5):
+            continue
+        headers = None
+        if len(fields) == 5:
+            headers = {"subject": fields[2], "sender": fields[3], "date": fields[4]}
+        messages.append((int(fields[0]), fields[1] == "true", headers))
+    return total, unread_ids, messages
+
+
+def headers_script(message_ids):
+    """
+    AppleScript returning subject, sender and date of the given messages, looked up by id so the
+    result doesn't depend on their position in the inbox. Used for unread mail older than the newest messages.
+    """
+    ids = ", ".join(str(int(message_id)) for message_id in message_ids)
+    return f"""
+    {DATE_HANDLERS}
+    set fieldSep to character id 31
+    set recordSep to character id 30
+    set theIds to {{{ids}}}
+    set output to {{}}
+    tell application "{app_name}"
+        repeat with i from 1 to count of theIds
+            set messageId to item i of theIds
+            try
+                set aMessage to first message of inbox whose id is messageId
+                set end of output to (messageId as text) & fieldSep & my textOrEmpty(subject of aMessage) & fieldSep & my textOrEmpty(sender of aMessage) & fieldSep & my isoDate(date received of aMessage)
+            end try
+        end repeat
+    end tell
+    set AppleScript's text item delimiters to recordSep
+    set outputText to output as text
+    set AppleScript's text item delimiters to ""
+    return outputText
+    """
+
+
+def parse_headers(stdout):
+    headers = {}
+    for record in stdout.rstrip("\n").split(RECORD_SEP):
+        fields = record.split(FIELD_SEP)
+        if len(fields) == 4:
+            headers[int(fields[0])] = {"id": int(fields[0]), "subject": fields[1], "sender": fields[2], "date": fields[3], "read": False}
+    return headers
+
+
+def body_script(message_id):
+    return f"""
+    tell application "{app_name}"
+        return content of (first message of inbox whose id is {int(message_id)})
+    end tell
+    """
+
+
+class MailStore:
+    """
+    Local copy of the newest inbox headers. Repeated calls only fetch the headers of mail that
+    arrived since the last sync (read status and counts are refreshed for all of them), and bodies
+    are loaded one message at a time when asked for, then kept in a small LRU. The ids of all unread
+    messages are synced too, so unread mail older than the newest `limit` messages can be listed.
+    """
+
+    def __init__(self, limit=50, refresh_interval=30, max_bodies=50, sync_attempts=3):
+        self.limit = limit
+        self.refresh_interval = refresh_interval
+        self.max_bodies = max_bodies
+        self.sync_attempts = sync_attempts
+        self.synced_at = 0
+        self.total = 0
+        self.unread = 0
+        self._order = []  # message ids, newest first
+        self._headers = {}  # id -> {"id", "subject", "sender", "date", "read"}
+        self._unread_ids = []  # every unread message, newest first
+        self._older = {}  # headers of unread messages below the newest `limit`
+        self._bodies = OrderedDict()
+        self._lock = threading.RLock()
+
+    def sync(self):
+        with self._lock:
+            known_ids = list(self._headers)
+        for attempt in range(self.sync_attempts):
+            stdout, stderr = run_applescript_capture(sync_script(self.limit, known_ids))
+            if stderr:
+                raise RuntimeError(stderr.strip())
+            state = parse_sync(stdout)
+            if state is not None:
+                break
+            # New mail arrived while the script ran, the indexes moved
+        else:
+            raise RuntimeError("The inbox kept changing while it was read, try again")
+        total, unread_ids, messages = state
+        with self._lock:
+            headers = {}
+            for message_id, read, fetched in messages:
+                header = self._headers.get(message_id)
+                if fetched is not None:
+                    header = dict(id=message_id, **fetched)
+                if header is None:
+                    # Moved below the fetched range while the script ran, picked up next sync
+                    continue
+                header["read"] = read
+                headers[message_id] = header
+            self._headers = headers
+            self._order = list(headers)
+            self._unread_ids = unread_ids
+            unread = set(unread_ids)
+            self._older = {message_id: header for message_id, header in self._older.items() if message_id in unread}
+            for message_id in list(self._bodies):
+                if message_id not in headers and message_id not in self._older:
+                    del self._bodies[message_id]
+            self.total = total
+            self.unread = len(unread_ids)
+            self.synced_at = time.time()
+
+    def ensure_fresh(self):
+        if time.time() - self.synced_at > self.refresh_interval:
+            self.sync()
+
+    def latest(self, number, unread=False):
+        """
+        Headers of the newest `number` inbox messages, or of the newest `number` unread ones
+        wherever they are in the inbox if unread is set.
+        """
+        self.ensure_fresh()
+        if not unread:
+            with self._lock:
+                headers = [self._headers[message_id] for message_id in self._order]
+            return [dict(header) for header in headers[:number]]
+
+        with self._lock:
+            wanted = self._unread_ids[:number]
+            missing = [message_id for message_id in wanted if message_id not in self._headers and message_id not in self._older]
+        if missing:
+            stdout, stderr = run_applescript_capture(headers_script(missing))
+            if stderr:
+                raise RuntimeError(stderr.strip())
+            with self._lock:
+                self._older.update(parse_headers(stdout))
+        with self._lock:
+            headers = [self._headers.get(message_id) or self._older.get(message_id) for message_id in wanted]
+        return [dict(header) for header in headers if header is not None]
+
+    def body(self, message_id):
+        message_id = int(message_id)
+        with self._lock:
+            if message_id in self._bodies:
+                self._bodies.move_to_end(message_id)
+                return self._bodies[message_id]
+        stdout, stderr = run_applescript_capture(body_script(message_id))
+        if stderr:
+            raise RuntimeError(stderr.strip())
+        body = stdout.rstrip("\n")
+        with self._lock:
+            self._bodies[message_id] = body
+            while len(self._bodies) > self.max_bodies:
+                self._bodies.popitem(last=False)
+        return body
+
+    def unread_count(self):
+        self.ensure_fresh()
+        return self.unread
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MailStore()
+        return _store
@@ -0,0 +1,199 @@
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app_utils import run_applescript_capture
+
+app_name = "Mail"
+
+# Job states: queued -> composing -> sending -> sent, or failed at any step. A message Mail accepted
+# but that didn't reach the Sent mailbox in time ends as sent_unconfirmed, Mail keeps retrying it
+FINISHED = ("sent", "sent_unconfirmed", "failed")
+
+
+def escape(text):
+    return text.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def compose_script(to, subject, body, attachments):
+    """
+    AppleScript that composes the message and adds the attachments, returning the message id.
+    Mail loads attachments asynchronously, so it returns right away; the message is sent once
+    attachments_loaded_script says they are all there.
+    """
+    attachment_clause = "\n".join(
+        f"make new attachment with properties {{file name:{path}}} at after the last paragraph of the content of new_message"
+        for path in attachments
+    )
+    return f"""
+    tell application "{app_name}"
+        set new_message to make new outgoing message with properties {{subject:"{escape(subject)}", content:"{escape(body)}"}} at end of outgoing messages
+        tell new_message
+            set visible to true
+            make new to recipient at end of to recipients with properties {{address:"{escape(to)}"}}
+            {attachment_clause}
+        end tell
+        return id of new_message
+    end tell
+    """
+
+
+def attachments_loaded_script(message_id, count):
+    return f"""
+    tell application "{app_name}"
+        set new_message to first outgoing message whose id is {int(message_id)}
+        if (count of attachments of content of new_message) < {count} then return "no"
+        return "yes"
+    end tell
+    """
+
+
+def send_script(message_id):
+    return f"""
+    tell application "{app_name}"
+        if send (first outgoing message whose id is {int(message_id)}) then return "sent"
+        return "failed"
+    end tell
+    """
+
+
+def delivered_script(subject, to, since):
+    """
+    AppleScript checking whether the message has reached the Sent mailbox.
+    """
+    return f"""
+    tell application "{app_name}"
+        set sentBox to sent mailbox
+        set matches to (messages of sentBox whose subject is "{escape(subject)}" and date sent > ((current date) - {int(time.time() - since) + 60}))
+        repeat with aMessage in matches
+            repeat with aRecipient in to recipients of aMessage
+                if address of aRecipient is "{escape(to)}" then return "yes"
+            end repeat
+        end repeat
+        return "no"
+    end tell
+    """
+
+
+class Outbox:
+    """
+    Background worker sending emails one at a time, so send_email returns a job id right away
+    instead of holding the request while Mail uploads attachments. Jobs are kept in memory,
+    the latest max_jobs of them can be looked up by id.
+    """
+
+    def __init__(self, max_jobs=200, confirm_timeout=120):
+        self.max_jobs = max_jobs
+        self.confirm_timeout = confirm_timeout
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def submit(self, to, subject, body, attachments=(), upload_timeout=30):
+        job = {
+            "id": uuid.uuid4().hex[:12],
+            "status": "queued",
+            "to": to,
+            "subject": subject,
+            "attachments": len(attachments),
+            "created_at": time.time(),
+            "finished_at": None,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="mail-outbox", daemon=True)
+                self._worker.start()
+        self._queue.put((job["id"], body, list(attachments), upload_timeout))
+        return job["id"]
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def jobs(self):
+        with self._lock:
+            return [dict(job) for job in reversed(self._jobs.values())]
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+                if fields.get("status") in FINISHED:
+                    self._jobs[job_id]["finished_at"] = time.time()
+
+    def _run(self):
+        while True:
+            job_id, body, attachments, upload_timeout = self._queue.get()
+            try:
+                self._send(job_id, body, attachments, upload_timeout)
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                self._update(job_id, status="failed", error=str(e))
+
+    def _send(self, job_id, body, attachments, upload_timeout):
+        job = self.status(job_id)
+        if job is None:
+            return
+        self._update(job_id, status="composing")
+        # Each script is short, the wait for large attachments happens here between scripts,
+        # so it never runs into the AppleScript timeout or holds a worker other tools need
+        stdout, stderr = run_applescript_capture(compose_script(job["to"], job["subject"], body, attachments))
+        message_id = stdout.strip()
+        if stderr or not message_id.isdigit():
+            self._update(job_id, status="failed", error=stderr.strip() or "Mail couldn't create the message")
+            return
+
+        if attachments:
+            delay = 0.2
+            deadline = time.time() + upload_timeout
+            while True:
+                stdout, stderr = run_applescript_capture(attachments_loaded_script(message_id, len(attachments)))
+                if stderr:
+                    self._update(job_id, status="failed", error=stderr.strip())
+                    return
+                if stdout.strip() == "yes":
+                    break
+                if time.time() > deadline:
+                    self._update(job_id, status="failed", error=f"Attachments didn't finish loading in {upload_timeout} seconds, the draft is left open in Mail")
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, 2)
+
+        stdout, stderr = run_applescript_capture(send_script(message_id))
+        if stderr or stdout.strip() != "sent":
+            self._update(job_id, status="failed", error=stderr.strip() or "Mail refused to send the message")
+            return
+
+        # Mail has the message, it is done once it shows up in the Sent mailbox
+        self._update(job_id, status="sending")
+        delay = 0.5
+        deadline = time.time() + self.confirm_timeout
+        while time.time() < deadline:
+            stdout, stderr = run_applescript_capture(delivered_script(job["subject"], job["to"], job["created_at"]))
+            if stdout.strip() == "yes":
+                self._update(job_id, status="sent")
+                return
+            time.sleep(delay)
+            delay = min(delay * 2, 8)
+        # Still in Mail's outbox, e.g. offline; Mail keeps retrying on its own
+        self._update(job_id, status="sent_unconfirmed", error=f"Not in the Sent mailbox after {self.confirm_timeout} seconds, Mail is still trying")
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+        return _outbox
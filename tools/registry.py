@@ -0,0 +1,264 @@
+# Tool registry. Functions exposed to the model are marked with @tool, their JSON schemas are generated
+# from the signature and the Google style docstring and written once to tools/tools.json, together with a
+# name -> "module:qualname" dispatch table. At runtime load_tools() only reads that artifact and tool
+# modules are imported the first time one of their tools is called.
+#
+# Regenerate the artifact with `python -m tools.registry`, it is also rebuilt when a tool module changes.
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import re
+import threading
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTIFACT_PATH = os.path.join(TOOLS_DIR, "tools.json")
+
+# Modules defining tools, in the order their schemas are listed
+TOOL_MODULES = [
+    "tools.functions",
+    "tools.sms",
+    "tools.contacts",
+    "tools.Calendar",
+    "tools.executecommand",
+    "tools.mail",
+    "tools.location",
+    "tools.MySocalApp",
+    "tools.jobs",
+]
+
+JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    dict: "object",
+}
+
+DOC_TYPES = {
+    "str": "string",
+    "string": "string",
+    "int": "integer",
+    "integer": "integer",
+    "float": "number",
+    "bool": "boolean",
+    "boolean": "boolean",
+    "list": "array",
+    "dict": "object",
+}
+
+_registered = []
+
+
+# Reply policies, see tool_policy.py
+POLICIES = ("model", "final", "template")
+
+
+def tool(name=None, enums=None, items=None, required=None, policy="model", template=None, success=None, background=False, attempts=None):
+    """
+    Marks a function as a tool. enums maps parameter names to their allowed values, items gives the
+    JSON schema of array items, and required overrides which parameters the model must provide.
+    policy says whether the result goes back to the model ("model"), is the reply ("final") or is
+    formatted locally with template; success is a regex a result must match to skip the model.
+    background tools are queued on the job queue (job_queue.py) instead of running in the request;
+    a failed job is only run again when attempts allows it, so only give it to idempotent tools.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown tool policy: {policy}")
+    if policy == "template" and not template:
+        raise ValueError("The template policy needs a template")
+
+    def decorator(function):
+        function.__tool__ = {
+            "name": name or function.__name__,
+            "enums": enums or {},
+            "items": items or {},
+            "required": required,
+            "policy": policy,
+            "template": template,
+            "success": success,
+            "background": background,
+            "attempts": attempts,
+        }
+        _registered.append(function)
+        return function
+    return decorator
+
+
+def parse_docstring(docstring):
+    """
+    Splits a Google style docstring into (description, {parameter: (type, description)}).
+    """
+    docstring = inspect.cleandoc(docstring or "")
+    sections = re.split(r"^\s*(Args|Returns|Raises):\s*$", docstring, flags=re.MULTILINE)
+    description = " ".join(sections[0].split())
+    arguments = {}
+    for header, body in zip(sections[1::2], sections[2::2]):
+        if header != "Args":
+            continue
+        current = None
+        for line in body.splitlines():
+            match = re.match(r"^\s*(\w+)\s*(?:\(([^)]*)\))?\s*:\s*(.*)$", line)
+            if match:
+                current = match.group(1)
+                arguments[current] = [match.group(2), match.group(3).strip()]
+            elif current and line.strip():
+                arguments[current][1] += " " + line.strip()
+    return description, {key: tuple(value) for key, value in arguments.items()}
+
+
+def _json_type(parameter, doc_type):
+    annotation = parameter.annotation
+    if annotation in JSON_TYPES:
+        return JSON_TYPES[annotation]
+    if doc_type:
+        base = doc_type.split(",")[0].split("[")[0].strip().lower()
+        if base in DOC_TYPES:
+            return DOC_TYPES[base]
+    if parameter.default not in (inspect.Parameter.empty, None) and type(parameter.default) in JSON_TYPES:
+        return JSON_TYPES[type(parameter.default)]
+    return "string"
+
+
+def build_schema(function):
+    """
+    OpenAI function-calling schema for a @tool function.
+    """
+    options = function.__tool__
+    description, documented = parse_docstring(function.__doc__)
+    properties = {}
+    required = []
+    for parameter in inspect.signature(function).parameters.values():
+        if parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+            continue
+        doc_type, doc_description = documented.get(parameter.name, (None, ""))
+        schema = {"type": _json_type(parameter, doc_type)}
+        if parameter.name in options["enums"]:
+            schema["enum"] = options["enums"][parameter.name]
+        if schema["type"] == "array":
+            schema["items"] = options["items"].get(parameter.name, {"type": "string"})
+        if doc_description:
+            schema["description"] = doc_description
+        properties[parameter.name] = schema
+        if parameter.default is inspect.Parameter.empty:
+            required.append(parameter.name)
+    if options["required"] is not None:
+        required = list(options["required"])
+    return {
+        "type": "function",
+        "function": {
+            "name": options["name"],
+            "description": description,
+            "parameters": {
+                "type": "object",
+                "properties": properties,
+                "required": required,
+            },
+        },
+    }
+
+
+def source_fingerprint():
+    """
+    Hash of the tool module sources, the artifact is stale when it doesn't match.
+    """
+    digest = hashlib.sha1()
+    for module in TOOL_MODULES + ["tools.registry"]:
+        path = os.path.join(os.path.dirname(TOOLS_DIR), *module.split(".")) + ".py"
+        digest.update(module.encode())
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def build_artifact():
+    """
+    Imports every tool module and collects the schemas and dispatch table of the @tool functions.
+    """
+    for module in TOOL_MODULES:
+        importlib.import_module(module)
+    tools = []
+    dispatch = {}
+    policies = {}
+    for function in _registered:
+        options = function.__tool__
+        name = options["name"]
+        if name in dispatch:
+            continue
+        tools.append(build_schema(function))
+        dispatch[name] = f"{function.__module__}:{function.__qualname__}"
+        if options["policy"] != "model" or options["background"]:
+            policies[name] = {key: options[key] for key in ("policy", "template", "success", "background", "attempts")}
+    return {"fingerprint": source_fingerprint(), "tools": tools, "dispatch": dispatch, "policies": policies}
+
+
+def write_artifact(path=ARTIFACT_PATH):
+    artifact = build_artifact()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(artifact, file, indent=4, ensure_ascii=False)
+        file.write("\n")
+    os.replace(tmp_path, path)
+    return artifact
+
+
+class LazyTool:
+    """
+    Entry of the dispatch table. The target is imported on the first call, so loading the registry
+    doesn't import every tool module and its dependencies.
+    """
+
+    def __init__(self, target, policy=None):
+        self.target = target
+        self.policy = policy or {"policy": "model"}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._function is None:
+            with self._lock:
+                if self._function is None:
+                    module_name, qualname = self.target.split(":")
+                    function = importlib.import_module(module_name)
+                    for attribute in qualname.split("."):
+                        function = getattr(function, attribute)
+                    self._function = function
+        return self._function
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"LazyTool({self.target!r})"
+
+
+def load_tools(path=ARTIFACT_PATH):
+    """
+    Returns (tool schemas, name -> callable) from the generated artifact, rebuilding it first
+    if a tool module changed since it was written.
+    """
+    try:
+        with open(path, "r") as file:
+            artifact = json.load(file)
+    except (OSError, ValueError):
+        artifact = None
+    if artifact is None or artifact.get("fingerprint") != source_fingerprint():
+        try:
+            artifact = write_artifact(path)
+        except OSError:
+            # Read-only install, use the fresh schemas without caching them
+            artifact = build_artifact()
+    policies = artifact.get("policies", {})
+    available_functions = {
+        name: LazyTool(target, policies.get(name)) for name, target in artifact["dispatch"].items()
+    }
+    return artifact["tools"], available_functions
+
+
+if __name__ == "__main__":
+    # Run as a script this module is __main__, the tool modules register with tools.registry
+    from tools.registry import write_artifact
+    artifact = write_artifact()
+    print(f"Wrote {len(artifact['tools'])} tool schemas to {ARTIFACT_PATH}")
@@ -0,0 +1,232 @@
+import datetime
+import json
+
+from tools.calendar_store import get_store
+
+# Free/busy solver for scheduling. Busy intervals from Google Calendar and Calendar.app are merged,
+# then the free gaps inside the working window of each day are searched for a slot of the requested
+# length. All times are timezone-aware in the local zone.
+
+DAY_START = 9
+DAY_END = 21
+
+# Hours of the parts of day a preference can name
+PARTS_OF_DAY = {
+    "morning": (9, 12),
+    "afternoon": (12, 17),
+    "evening": (17, 21),
+}
+
+PREFERENCES_PROMPT = """
+You turn a meeting time preference into JSON. Today is {today} ({weekday}), local time {time}.
+Return a JSON object with these keys, null when the preference doesn't say:
+"duration_minutes": meeting length in minutes,
+"earliest": first acceptable start as "YYYY-MM-DDTHH:MM",
+"latest": last acceptable end as "YYYY-MM-DDTHH:MM",
+"weekdays": list of acceptable weekdays, 0 is Monday and 6 is Sunday,
+"part_of_day": "morning", "afternoon" or "evening".
+For a specific time like "next Tuesday at 3PM" set earliest to that time.
+"""
+
+
+def local(value):
+    """
+    Parses an ISO 8601 / RFC 3339 string (or takes a datetime) and returns it in the local zone.
+    Naive values, like the ones from Calendar.app, are taken as local time.
+    """
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value.astimezone()
+
+
+def merge(intervals):
+    """
+    Sorts (start, end) intervals and merges the ones that overlap or touch.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def google_busy(range_start, range_end, attendees=()):
+    """
+    Busy intervals of the primary Google calendar, and of the attendees' calendars where
+    their free/busy information is visible, with one freebusy query.
+    """
+    from tools.google_auth import get_calendar_service
+    body = {
+        "timeMin": range_start.isoformat(),
+        "timeMax": range_end.isoformat(),
+        "items": [{"id": "primary"}] + [{"id": email} for email in attendees],
+    }
+    response = get_calendar_service().freebusy().query(body=body).execute()
+    busy = []
+    for calendar_id, calendar in response.get("calendars", {}).items():
+        if calendar.get("errors"):
+            # Not shared with us, or not a Google account
+            print(f"No free/busy information for {calendar_id}: {calendar['errors']}")
+            continue
+        busy.extend((local(interval["start"]), local(interval["end"])) for interval in calendar.get("busy", []))
+    return busy
+
+
+def apple_busy(range_start, range_end):
+    """
+    Busy intervals from Calendar.app, answered by the local event store. All-day events
+    (birthdays, holidays) don't block time.
+    """
+    busy = []
+    for event in get_store().query(range_start.date(), range_end.date()):
+        start, end = local(event["start"]), local(event["end"])
+        if start.time() == datetime.time() and end - start >= datetime.timedelta(days=1):
+            continue
+        busy.append((start, end))
+    return busy
+
+
+def busy_intervals(range_start, range_end, attendees=(), google=True, apple=True):
+    """
+    Merged busy intervals of every available calendar. A calendar that can't be read is skipped,
+    so the search still works with the other one.
+    """
+    busy = []
+    sources = []
+    if google:
+        sources.append(("Google Calendar", lambda: google_busy(range_start, range_end, attendees)))
+    if apple:
+        sources.append(("Calendar.app", lambda: apple_busy(range_start, range_end)))
+    for name, fetch in sources:
+        try:
+            busy.extend(fetch())
+        except Exception as e:
+            print(f"Couldn't read {name}: {e}")
+    return merge(busy)
+
+
+def free_gaps(busy, range_start, range_end, day_start=DAY_START, day_end=DAY_END, weekdays=None):
+    """
+    Free (start, end) gaps between the merged busy intervals, inside the working hours of each day.
+    """
+    gaps = []
+    day = range_start.date()
+    index = 0
+    while day <= range_end.date():
+        if weekdays is None or day.weekday() in weekdays:
+            window_start = max(range_start, datetime.datetime.combine(day, datetime.time(day_start)).astimezone())
+            window_end = min(range_end, datetime.datetime.combine(day, datetime.time(day_end)).astimezone())
+            cursor = window_start
+            # Busy intervals are sorted, skip the ones that ended before this window
+            while index < len(busy) and busy[index][1] <= window_start:
+                index += 1
+            position = index
+            while cursor < window_end and position < len(busy) and busy[position][0] < window_end:
+                start, end = busy[position]
+                if start > cursor:
+                    gaps.append((cursor, start))
+                cursor = max(cursor, end)
+                position += 1
+            if cursor < window_end:
+                gaps.append((cursor, window_end))
+        day += datetime.timedelta(days=1)
+    return gaps
+
+
+def align(value, step):
+    # Rounds up to the next multiple of step minutes past the hour
+    minutes = -(-(value.minute * 60 + value.second + value.microsecond / 1e6) // (step * 60)) * step
+    return value.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(minutes=minutes)
+
+
+def rank_slots(gaps, duration, part_of_day=None, count=5, step=30):
+    """
+    Candidate slots, at most one per free gap: the first start in the preferred part of the day
+    if the gap allows it, otherwise the first start. Preferred slots rank first, then earlier ones.
+    """
+    preferred = PARTS_OF_DAY.get(part_of_day)
+    candidates = []
+    for gap_start, gap_end in gaps:
+        start = align(gap_start, step)
+        if start + duration > gap_end:
+            continue
+        in_part = False
+        if preferred:
+            part_start = max(start, start.replace(hour=preferred[0], minute=0))
+            part_end = min(gap_end, start.replace(hour=preferred[1], minute=0))
+            part_start = align(part_start, step)
+            if part_start + duration <= part_end:
+                start, in_part = part_start, True
+        candidates.append((not in_part, start))
+    candidates.sort()
+    return [
+        {
+            "start": start.isoformat(timespec="seconds"),
+            "end": (start + duration).isoformat(timespec="seconds"),
+            "preferred": bool(preferred) and not penalty,
+        }
+        for penalty, start in candidates[:count]
+    ]
+
+
+def parse_preferences(text, now=None):
+    """
+    Turns a fuzzy time preference ("next week, ideally a morning") into the solver's constraints
+    with one small completion. Returns {} when there's nothing to parse or the reply isn't usable.
+    """
+    if not text or not str(text).strip():
+        return {}
+    from clients import get_openai
+    now = now or datetime.datetime.now().astimezone()
+    prompt = PREFERENCES_PROMPT.format(
+        today=now.date().isoformat(), weekday=now.strftime("%A"), time=now.strftime("%H:%M")
+    )
+    try:
+        response = get_openai().chat.completions.create(
+            model="gpt-4-turbo",
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": str(text)},
+            ],
+            response_format={"type": "json_object"},
+            temperature=0,
+        )
+        preferences = json.loads(response.choices[0].message.content)
+    except Exception as e:
+        print(f"Couldn't parse time preferences: {e}")
+        return {}
+    return preferences if isinstance(preferences, dict) else {}
+
+
+def suggest_slots(preferences=None, duration_minutes=60, attendees=(), count=5, horizon_days=14, google=True, apple=True, now=None):
+    """
+    Ranked free slots for a meeting, searched over the next horizon_days between 9am and 9pm.
+
+    Args:
+    preferences (dict): Constraints as returned by parse_preferences
+    duration_minutes (int): Meeting length, unless the preferences give one
+    attendees (list): Emails whose Google free/busy should be respected too
+    count (int): Number of candidates to return
+    """
+    preferences = preferences or {}
+    now = now or datetime.datetime.now().astimezone()
+    duration = datetime.timedelta(minutes=int(preferences.get("duration_minutes") or duration_minutes))
+
+    range_start = now
+    range_end = now + datetime.timedelta(days=horizon_days)
+    try:
+        if preferences.get("earliest"):
+            range_start = max(now, local(preferences["earliest"]))
+        if preferences.get("latest"):
+            range_end = local(preferences["latest"])
+    except ValueError as e:
+        print(f"Ignoring time range: {e}")
+    if range_end <= range_start:
+        range_end = range_start + datetime.timedelta(days=horizon_days)
+
+    weekdays = preferences.get("weekdays") or None
+    busy = busy_intervals(range_start, range_end, attendees, google=google, apple=apple)
+    gaps = free_gaps(busy, range_start, range_end, weekdays=set(weekdays) if weekdays else None)
+    return rank_slots(gaps, duration, preferences.get("part_of_day"), count=count)
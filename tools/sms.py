@@ -1,15 +1,20 @@
 import subprocess
 import platform
 from app_utils import run_applescript
+from tools.registry import tool
 
 class SMS:
     @staticmethod
+    @tool(policy="template", template='Sent "{message}" to {to}.', success="SMS message sent")
     def send_sms(to: str, message: str) -> str:
-        print ("Sending SMS to:", to, "with message:", message)
-
         """
         Sends an SMS message to the specified recipient using the Messages app.
+
+        Args:
+        to (str): The recipient phone number
+        message (str): The message to be sent
         """
+        print ("Sending SMS to:", to, "with message:", message)
         # Check if the operating system is MacOS, as this functionality is MacOS-specific.
         if platform.system() != 'Darwin':
             return "This method is only supported on MacOS"